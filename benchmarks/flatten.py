@@ -0,0 +1,103 @@
+""" HieraData.flatten() のベンチマーク
+
+    python -m benchmarks.flatten [--layers N] [--keys N]
+
+key 索引を使う現行の flatten() と、key ごとに全レイヤを走査していた
+従来の実装とを合成した大きな hierarchy で比較する。
+"""
+import argparse
+import pathlib
+import tempfile
+import time
+
+from pyhiera import Hiera
+from pyhiera.yaml import dump_yaml
+
+
+def generate(base_dir, layers=40, keys=5000, overlap=4):
+    """ layers 個のレイヤを持つ hiera 設定を base_dir に作る
+
+    各レイヤは keys 個の key を持ち、隣接するレイヤとは keys / overlap 個ずつ key をずらす。
+    """
+    base_dir = pathlib.Path(base_dir)
+    datadir = base_dir.joinpath('data')
+    datadir.mkdir(parents=True, exist_ok=True)
+    step = max(keys // overlap, 1)
+    for num in range(layers):
+        data = {
+            'key_{:06d}'.format(num * step + i): 'value_{}_{}'.format(num, i)
+            for i in range(keys)
+        }
+        with datadir.joinpath('layer_{:03d}.yaml'.format(num)).open('w') as fp:
+            dump_yaml(data, stream=fp)
+
+    config = {
+        'version': 5,
+        'hierarchy': [
+            {
+                'name': 'layer_{:03d}'.format(num),
+                'path': 'layer_{:03d}.yaml'.format(num),
+            }
+            for num in range(layers)
+        ],
+    }
+    config_file = base_dir.joinpath('hiera.yaml')
+    with config_file.open('w') as fp:
+        dump_yaml(config, stream=fp)
+    return config_file
+
+
+def flatten_rescan(data):
+    """ 索引を使わずに key ごとに .values を走査する従来の flatten()
+    """
+    def lookup_first(key):
+        return next((item[key] for item in data.values if key in item), None)
+
+    keys = set.union(*[set(el) for el in data.values]) - {'lookup_options'}
+    return {key: lookup_first(key) for key in keys}
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, ret
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.flatten')
+    parser.add_argument('--layers', type=int, default=40)
+    parser.add_argument('--keys', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config_file = generate(tmpdir, layers=options.layers, keys=options.keys)
+        data = Hiera.load_data(config_file)
+        layers = list(data.values)          # ファイルの読み込みは計測から除く
+
+        def flatten_index():
+            # 読み込み済みのレイヤから索引を作り直すところから計測する (HieraData.refresh() と同じ手順)
+            data.loaded = []
+            data.loaded_index = {}
+            data.indexed = []
+            data._layers = iter(layers)
+            for name in ('_index', '_looup_options', '_sorted_keys'):
+                data.__dict__.pop(name, None)
+            return data.flatten()
+
+        t_rescan, r_rescan = measure(lambda: flatten_rescan(data), options.repeat)
+        t_index, r_index = measure(flatten_index, options.repeat)
+
+    assert r_rescan == r_index
+    print('layers={} keys={} total_keys={}'.format(options.layers, options.keys, len(r_index)))
+    print('rescan: {:.4f}s'.format(t_rescan))
+    print('index:  {:.4f}s'.format(t_index))
+    print('speedup: {:.1f}x'.format(t_rescan / t_index))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+""" ベンチマーク用の合成 hierarchy を作る
+"""
+import os
+
+from pyhiera.yaml import dump_yaml
+
+
+DEFAULTS = {
+    'layers': 12,
+    'files_per_glob': 10,
+    'keys': 100,
+    'depth': 3,
+    'array_length': 20,
+}
+
+
+def make_value(layer, key, depth, array_length):
+    """ depth 段の hash で、末端に配列と補間を含む文字列を持つ値を作る
+    """
+    if depth == 0:
+        return ['{}_{}_{}'.format(key, layer // 2, i) for i in range(array_length)]
+    ret = {
+        'name': '{}-%{{environment}}-{}'.format(key, layer),
+        'level_{}'.format(depth): make_value(layer, key, depth - 1, array_length),
+    }
+    ret['layer_{}'.format(layer % 3)] = layer
+    return ret
+
+
+def make_layer(layer, keys, depth, array_length, offset=0):
+    ret = {}
+    for num in range(offset, offset + keys):
+        ret['key_{}'.format(num)] = make_value(layer, 'key_{}'.format(num), depth, array_length)
+        ret['list_{}'.format(num)] = ['item_{}'.format((layer + i) % (array_length * 2)) for i in range(array_length)]
+    return ret
+
+
+def write_yaml(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fp:
+        dump_yaml(data, stream=fp)
+
+
+def generate(base_dir, layers=12, files_per_glob=10, keys=100, depth=3, array_length=20):
+    """ base_dir に hiera.yaml と datadir を作り、設定ファイルのパスを返す
+
+    レイヤは 4 つに 1 つが files_per_glob 個のファイルにマッチする glob で、残りは path。
+    どのレイヤも keys 個の hash の key (key_N) と配列の key (list_N) を持ち、隣のレイヤと半分ずつ重なる。
+    最下位のレイヤは lookup_options を持つ。
+    """
+    datadir = os.path.join(base_dir, 'data')
+    hierarchy = []
+    for layer in range(layers):
+        name = 'layer_{:03d}'.format(layer)
+        offset = layer * keys // 2
+        if layer % 4 == 1:
+            hierarchy.append({'name': name, 'glob': '{}/*.yaml'.format(name)})
+            per_file = max(keys // files_per_glob, 1)
+            for num in range(files_per_glob):
+                write_yaml(
+                    os.path.join(datadir, name, 'file_{:03d}.yaml'.format(num)),
+                    make_layer(layer, per_file, depth, array_length, offset=offset + num * per_file),
+                )
+        else:
+            hierarchy.append({'name': name, 'path': '{}.yaml'.format(name)})
+            data = make_layer(layer, keys, depth, array_length, offset=offset)
+            if layer == layers - 1:
+                data['lookup_options'] = {
+                    'key_0': {'merge': 'deep'},
+                    'list_0': {'merge': 'unique'},
+                }
+            write_yaml(os.path.join(datadir, '{}.yaml'.format(name)), data)
+
+    config_file = os.path.join(base_dir, 'hiera.yaml')
+    write_yaml(config_file, {
+        'version': 5,
+        'defaults': {'datadir': 'data'},
+        'hierarchy': hierarchy,
+    })
+    return config_file
@@ -0,0 +1,89 @@
+""" 起動時の import にかかる時間のベンチマーク
+
+    python -m benchmarks.importtime [--repeat N] [--top N]
+
+python -X importtime で `pyhiera --version` と `import pyhiera` を計測し、
+累積時間の大きいモジュールを表示する。起動時に読み込むべきでないモジュール (HEAVY_MODULES) が
+読み込まれていれば終了コード 1 で終わるので、起動の遅れを検出するのにも使える。
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+COMMANDS = {
+    'version': ['-m', 'pyhiera', '--version'],
+    'import': ['-c', 'import pyhiera'],
+}
+
+HEAVY_MODULES = (
+    'yaml',
+    'json',
+    'pprint',
+    'logging',
+    'asyncio',
+    'concurrent.futures',
+    'socket',
+    'pyhiera.hiera',
+    'pyhiera.backend',
+)
+
+
+def parse_importtime(stderr):
+    """ -X importtime の出力を {モジュール名: 累積時間 (us)} にする
+    """
+    ret = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        ret[fields[2].strip()] = int(fields[1])
+    return ret
+
+
+def measure(args):
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return parse_importtime(proc.stderr)
+
+
+def heavy_imports(modules):
+    return sorted(
+        name for name in modules
+        if any(name == heavy or name.startswith(heavy + '.') for heavy in HEAVY_MODULES)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.importtime')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    options = parser.parse_args()
+
+    failed = False
+    for name, args in COMMANDS.items():
+        runs = [measure(args) for _ in range(options.repeat)]
+        pyhiera_times = [sum(t for mod, t in modules.items() if mod in ('pyhiera', 'pyhiera.cli'))
+                         for modules in runs]
+        print('{}: pyhiera imports {:.1f}ms (median of {})'.format(
+            name, statistics.median(pyhiera_times) / 1000, options.repeat,
+        ))
+        for mod, t in sorted(runs[-1].items(), key=lambda item: -item[1])[:options.top]:
+            print('  {:>9.1f}ms  {}'.format(t / 1000, mod))
+        heavy = heavy_imports(runs[-1])
+        if heavy:
+            failed = True
+            print('  heavy modules imported at startup: {}'.format(' '.join(heavy)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
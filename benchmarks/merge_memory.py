@@ -0,0 +1,133 @@
+""" deep merge のメモリ使用量のベンチマーク
+
+    python -m benchmarks.merge_memory [--layers N] [--width N] [--depth N]
+
+深く広い hash を deep merge で flatten() したときのピーク RSS と tracemalloc のピークを、
+変わらない部分木を共有する現行の実装と、各段で dict を作り直していた従来の実装とで比較する。
+計測は実装ごとに別プロセスで行う。
+"""
+import argparse
+import copy
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+from pyhiera import Hiera
+from pyhiera.hieradata import HieraData
+from pyhiera.yaml import dump_yaml
+
+
+def make_tree(width, depth, layer):
+    if depth == 0:
+        return ['item_{}'.format(i) for i in range(4)] + ['layer_{}'.format(layer)]
+    return {
+        'node_{}'.format(i): make_tree(width, depth - 1, layer) if i or not layer else 'override_{}'.format(layer)
+        for i in range(width)
+    }
+
+
+def generate(base_dir, layers, width, depth, keys):
+    datadir = '{}/data'.format(base_dir)
+    os.makedirs(datadir, exist_ok=True)
+    for num in range(layers):
+        data = {
+            'key_{}'.format(k): make_tree(width, depth, num)
+            for k in range(keys)
+        }
+        if num == layers - 1:
+            data['lookup_options'] = {
+                'key_{}'.format(k): {'merge': 'deep'}
+                for k in range(keys)
+            }
+        with open('{}/layer_{:03d}.yaml'.format(datadir, num), 'w') as fp:
+            dump_yaml(data, stream=fp)
+    config = {
+        'version': 5,
+        'hierarchy': [
+            {'name': 'layer_{:03d}'.format(num), 'path': 'layer_{:03d}.yaml'.format(num)}
+            for num in range(layers)
+        ],
+    }
+    config_file = '{}/hiera.yaml'.format(base_dir)
+    with open(config_file, 'w') as fp:
+        dump_yaml(config, stream=fp)
+    return config_file
+
+
+class LegacyHieraData(HieraData):
+    """ 補間のたびに値を複製し、deep merge の各段で dict を作り直していた従来の実装
+    """
+    def matches(self, key):
+        return [copy.deepcopy(val) for val in super().matches(key)]
+
+    def merge_deep(self, lval, rval):
+        if rval is self.DOESNOTEXIST:
+            return lval
+
+        if lval is self.DOESNOTEXIST:
+            return rval.copy() if isinstance(rval, (dict, list)) else rval
+
+        if isinstance(lval, dict) and isinstance(rval, dict):
+            return {
+                key: self.merge_deep(lval.get(key, self.DOESNOTEXIST), rval.get(key, self.DOESNOTEXIST))
+                for key in set(lval) | set(rval)
+            }
+
+        if isinstance(lval, list) and isinstance(rval, list):
+            lval.extend([el for el in rval if el not in lval])
+            return lval
+
+        return rval
+
+
+def run(config_file, variant):
+    data = Hiera.load_data(config_file)
+    if variant == 'legacy':
+        data.__class__ = LegacyHieraData
+    data.values
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    flat = data.flatten()
+    traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'keys': len(flat),
+        'maxrss_kb': rss_after,
+        'maxrss_growth_kb': rss_after - rss_before,
+        'traced_peak_kb': traced // 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.merge_memory')
+    parser.add_argument('--layers', type=int, default=10)
+    parser.add_argument('--width', type=int, default=6)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--keys', type=int, default=8)
+    parser.add_argument('--run', nargs=2, metavar=('CONFIG_FILE', 'VARIANT'), help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.run:
+        return run(*options.run)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config_file = generate(tmpdir, options.layers, options.width, options.depth, options.keys)
+        results = {}
+        for variant in ('legacy', 'shared'):
+            out = subprocess.check_output([sys.executable, '-m', 'benchmarks.merge_memory', '--run', config_file, variant])
+            results[variant] = json.loads(out.decode('utf-8'))
+
+    print('{:>8} {:>14} {:>18} {:>16}'.format('variant', 'maxrss_kb', 'maxrss_growth_kb', 'traced_peak_kb'))
+    for variant, result in results.items():
+        print('{:>8} {:>14} {:>18} {:>16}'.format(
+            variant, result['maxrss_kb'], result['maxrss_growth_kb'], result['traced_peak_kb'],
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+""" sqlite_data バックエンドのベンチマーク
+
+    python -m benchmarks.sqlite_lookup [--layers N] [--files-per-glob N] [--keys N] [--depth N] [--array-length N]
+
+合成した hierarchy を `pyhiera import-sqlite` と同じようにデータベースに取り込み、
+読み込みから単一 key の lookup までを yaml_data と sqlite_data で比較する。
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from pyhiera import Hiera
+from pyhiera.backend import sqlite_data
+from pyhiera.yaml import dump_yaml, load_yaml
+
+from . import generator
+
+
+LOOKUPS = {
+    'first': 'key_0',
+    'deep': 'key_0',
+    'unique': 'list_0',
+}
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, ret
+
+
+def sqlite_config(config_file):
+    """ config_file の datadir を取り込んだデータベースを読む設定ファイルを隣に作る
+    """
+    with open(config_file) as fp:
+        config = load_yaml(fp)
+    base_dir = os.path.dirname(config_file)
+    datadir = config['defaults']['datadir']
+    sqlite_data.import_datadir(os.path.join(base_dir, datadir), os.path.join(base_dir, datadir + sqlite_data.SUFFIX))
+    config['defaults']['data_hash'] = 'sqlite_data'
+    ret = os.path.join(base_dir, 'hiera-sqlite.yaml')
+    with open(ret, 'w') as fp:
+        dump_yaml(config, stream=fp)
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.sqlite_lookup')
+    for name, default in generator.DEFAULTS.items():
+        parser.add_argument('--{}'.format(name.replace('_', '-')), type=int, default=default)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    params = {name: getattr(options, name) for name in generator.DEFAULTS}
+    context = {'environment': 'bench'}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configs = {'yaml_data': generator.generate(tmpdir, **params)}
+        configs['sqlite_data'] = sqlite_config(configs['yaml_data'])
+
+        results = {}
+        for backend, config_file in configs.items():
+            for strategy, key in LOOKUPS.items():
+                def lookup():
+                    return Hiera.load_data(config_file, context=context).lookup(key, strategy=strategy)
+                results[backend, strategy] = measure(lookup, options.repeat)
+            results[backend, 'flatten'] = measure(
+                lambda: Hiera.load_data(config_file, context=context).flatten(), options.repeat,
+            )
+
+    print('{:<10} {:>10} {:>12} {:>8}'.format('lookup', 'yaml_data', 'sqlite_data', 'speedup'))
+    for name in list(LOOKUPS) + ['flatten']:
+        t_yaml, r_yaml = results['yaml_data', name]
+        t_sqlite, r_sqlite = results['sqlite_data', name]
+        assert r_yaml == r_sqlite, name
+        print('{:<10} {:>9.4f}s {:>11.4f}s {:>7.1f}x'.format(name, t_yaml, t_sqlite, t_yaml / t_sqlite))
+
+
+if __name__ == '__main__':
+    main()
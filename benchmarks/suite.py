@@ -0,0 +1,122 @@
+""" pyhiera のベンチマークスイート
+
+    python -m benchmarks.suite [--layers N] [--files-per-glob N] [--keys N] [--depth N] [--array-length N]
+                               [--output RESULT.json] [--compare BASELINE.json]
+
+合成した hierarchy について、読み込み、strategy ごとの単一 key の lookup、flatten()、
+CLI の実行全体を計測し、結果を JSON で保存する。--compare で以前の結果と比較する。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pyhiera import Hiera
+
+from . import generator
+
+
+LOOKUPS = {
+    'first': 'key_0',
+    'hash': 'key_0',
+    'deep': 'key_0',
+    'unique': 'list_0',
+}
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+    }
+
+
+def load_data(config_file):
+    return Hiera.load_data(config_file, context={'environment': 'bench'})
+
+
+def run(config_file, repeat):
+    results = {}
+    results['load'] = measure(lambda: load_data(config_file).values, repeat)
+
+    for strategy, key in LOOKUPS.items():
+        def lookup():
+            load_data(config_file).lookup(key, strategy=strategy)
+        results['lookup_{}'.format(strategy)] = measure(lookup, repeat)
+
+    data = load_data(config_file)
+    data.values
+    results['flatten'] = measure(data.flatten, repeat)
+
+    command = [sys.executable, '-m', 'pyhiera', config_file, '-e', 'bench']
+    with open(os.devnull, 'w') as devnull:
+        results['cli'] = measure(lambda: subprocess.check_call(command, stdout=devnull), repeat)
+    return results
+
+
+def git_revision():
+    try:
+        out = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode('utf-8').strip()
+
+
+def compare(results, baseline):
+    print('{:<16} {:>10} {:>10} {:>8}'.format('benchmark', 'baseline', 'current', 'ratio'))
+    for name, value in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        print('{:<16} {:>9.4f}s {:>9.4f}s {:>7.2f}x'.format(
+            name, base['min'], value['min'], value['min'] / base['min'],
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite')
+    for name, default in generator.DEFAULTS.items():
+        parser.add_argument('--{}'.format(name.replace('_', '-')), type=int, default=default)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', '-o', default=None, metavar='RESULT.json')
+    parser.add_argument('--compare', '-c', default=None, metavar='BASELINE.json')
+    options = parser.parse_args()
+
+    params = {name: getattr(options, name) for name in generator.DEFAULTS}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config_file = generator.generate(tmpdir, **params)
+        results = {
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'params': params,
+            'results': run(config_file, options.repeat),
+        }
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+            fp.write('\n')
+
+    if options.compare:
+        with open(options.compare) as fp:
+            compare(results, json.load(fp))
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
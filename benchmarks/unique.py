@@ -0,0 +1,64 @@
+""" unique merge の重複除去のマイクロベンチマーク
+
+    python -m benchmarks.unique [--layers N] [--sizes N ...]
+
+'el not in ret' による従来の重複除去と Membership による重複除去とを、
+配列の長さを倍々にしながら比較する。従来の実装は長さの 2 乗で、現行の実装は長さに比例して増える。
+"""
+import argparse
+import time
+
+from pyhiera.hieradata import Membership, extend_unique
+
+
+def make_layers(layers, size):
+    """ 互いに半分ずつ重なる、文字列と dict の混ざった配列を layers 個作る
+    """
+    ret = []
+    for num in range(layers):
+        start = num * size // 2
+        ret.append([
+            {'name': 'acl_{}'.format(i), 'allow': [i % 7]} if i % 10 == 0 else 'pkg_{}'.format(i)
+            for i in range(start, start + size)
+        ])
+    return ret
+
+
+def unique_rescan(layers):
+    ret = []
+    for item in layers:
+        ret.extend([el for el in item if el not in ret])
+    return ret
+
+
+def unique_membership(layers):
+    ret = []
+    members = Membership()
+    for item in layers:
+        extend_unique(ret, item, members)
+    return ret
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    ret = func(*args)
+    return time.perf_counter() - start, ret
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.unique')
+    parser.add_argument('--layers', type=int, default=8)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 4000])
+    options = parser.parse_args()
+
+    print('{:>8} {:>10} {:>10} {:>8}'.format('size', 'rescan', 'membership', 'speedup'))
+    for size in options.sizes:
+        layers = make_layers(options.layers, size)
+        t_rescan, r_rescan = measure(unique_rescan, layers)
+        t_members, r_members = measure(unique_membership, layers)
+        assert r_rescan == r_members
+        print('{:>8} {:>9.4f}s {:>9.4f}s {:>7.1f}x'.format(size, t_rescan, t_members, t_rescan / t_members))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,22 @@
 __version__ = '1.0.2203.3'
 
-from .hiera import Hiera
+import sys
+
 from .exceptions import (
     HieraError,
     HieraConfigError,
 )
 
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # Hiera は yaml などを読み込むため、使われるまで import しない (pyhiera --version を速くする)
+        if name == 'Hiera':
+            from .hiera import Hiera
+            return Hiera
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+else:
+    from .hiera import Hiera  # noqa: F401
+
 __all__ = (
     'Hiera',
     'HieraError',
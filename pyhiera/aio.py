@@ -0,0 +1,31 @@
+import asyncio
+
+from .yaml import load_yaml_file
+
+
+class InflightLoads:
+    """ イベントループごとに、読み込み中のデータファイルの Future を共有する
+
+    同じファイルを同時に要求したコルーチンは、一つの読み込みの結果を待つ。
+    """
+    def __init__(self):
+        self.futures = {}
+
+    def load(self, hiera, path):
+        """ path を Executor で読み込む Future を返す; 読めないファイルの結果は None
+        """
+        loop = asyncio.get_event_loop()
+        key = (loop, str(path))
+        future = self.futures.get(key)
+        if future is None:
+            if hiera.executor_type == 'process' and hiera.executor is not None:
+                future = loop.run_in_executor(hiera.executor, load_yaml_file, path)
+            else:
+                future = loop.run_in_executor(hiera.executor, hiera.try_load_file, path)
+            self.futures[key] = future
+            future.add_done_callback(lambda _: self.futures.pop(key, None))
+        # 待っている側が取り消されても、共有している読み込みは取り消さない
+        return asyncio.shield(future)
+
+
+inflight_loads = InflightLoads()
@@ -0,0 +1,298 @@
+import collections.abc
+import os
+import pathlib
+import pickle
+import threading
+
+from pyhiera.cache import file_stamp
+from pyhiera.dirindex import compile_pattern
+from pyhiera.exceptions import HieraError, HieraConfigError
+from pyhiera.hieradata import HieraDataItem
+from pyhiera.log import logger
+from pyhiera.snapshot import HieraSnapshot
+from pyhiera.yaml import load_yaml_file
+
+from . import yaml_data as backend_yaml_data
+
+
+SUFFIX = '.sqlite3'                     # データベースの既定のパスは datadir にこれを付けたもの
+
+SCHEMA = (
+    'CREATE TABLE layers (layer TEXT PRIMARY KEY)',
+    'CREATE TABLE data (layer TEXT NOT NULL, key NOT NULL, value BLOB NOT NULL)',
+)
+INDEXES = (
+    'CREATE UNIQUE INDEX data_layer_key ON data (layer, key)',
+)
+
+MISSING = object()
+
+
+def encode_key(key):
+    """ key を data.key 列の値にする; 文字列以外の key は pickle した BLOB にする
+    """
+    return key if isinstance(key, str) else pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_key(value):
+    return pickle.loads(value) if isinstance(value, bytes) else value
+
+
+class HieraSqliteDatabase:
+    """ import_datadir() で作った SQLite のデータベース; レイヤ (datadir からの相対パス) ごとに key と値を持つ
+
+    値は問い合わせた key の行だけを解析する。接続はスレッド間で共有するので、問い合わせは lock の中で行う。
+    """
+    def __init__(self, path):
+        import sqlite3
+        self.path = str(path)
+        self.stamp = file_stamp(self.path)
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        try:
+            self.connection = sqlite3.connect(
+                pathlib.Path(self.path).absolute().as_uri() + '?mode=ro',
+                uri=True,
+                check_same_thread=False,
+            )
+            self.connection.execute('SELECT layer FROM layers LIMIT 1')
+        except sqlite3.Error as err:
+            raise HieraError("cannot open sqlite database: {0}; database={1}".format(err, self.path))
+
+    def __repr__(self):
+        return '<{0.__module__}.{0.__name__} database="{self.path}">'.format(
+            self.__class__,
+            self=self,
+        )
+
+    def query(self, sql, *params):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    @property
+    def layers(self):
+        """ データベースにあるレイヤの列; パスの順に並べる
+        """
+        try:
+            return self._layers
+        except AttributeError:
+            pass
+        ret = self._layers = sorted(
+            (layer for layer, in self.query('SELECT layer FROM layers')),
+            key=lambda layer: layer.split('/'),
+        )
+        return ret
+
+    def get(self, layer, key, default=None):
+        rows = self.query('SELECT value FROM data WHERE layer = ? AND key = ?', layer, encode_key(key))
+        return pickle.loads(rows[0][0]) if rows else default
+
+    def contains(self, layer, key):
+        return bool(self.query('SELECT 1 FROM data WHERE layer = ? AND key = ?', layer, encode_key(key)))
+
+    def keys(self, layer):
+        """ layer の key を YAML ファイルに書かれていた順に得る
+        """
+        return [decode_key(key) for key, in self.query('SELECT key FROM data WHERE layer = ? ORDER BY rowid', layer)]
+
+    def items(self, layer):
+        return [
+            (decode_key(key), pickle.loads(value))
+            for key, value in self.query('SELECT key, value FROM data WHERE layer = ? ORDER BY rowid', layer)
+        ]
+
+    def count(self, layer):
+        return self.query('SELECT count(*) FROM data WHERE layer = ?', layer)[0][0]
+
+
+databases = {}
+databases_lock = threading.Lock()
+
+
+def open_database(path):
+    """ path のデータベースを開く; このプロセスで開いたものがあり、ファイルが変わっていなければそれを使う
+    """
+    path = str(path)
+    with databases_lock:
+        database = databases.get(path)
+        if database is None or database.pid != os.getpid() or database.stamp != file_stamp(path):
+            database = databases[path] = HieraSqliteDatabase(path)
+        return database
+
+
+def import_datadir(datadir, database):
+    """ datadir 以下の YAML ファイルをデータベース database に書き出し、(レイヤの数, key の数) を返す
+    """
+    import sqlite3
+    datadir = pathlib.Path(datadir)
+    database = pathlib.Path(database)
+    if not datadir.is_dir():
+        raise HieraConfigError("datadir is not a directory: {0}".format(datadir))
+
+    sources = sorted({path for pattern in HieraSnapshot.PATTERNS for path in datadir.glob(pattern) if path.is_file()})
+    tmppath = database.with_name(database.name + '.tmp')
+    if tmppath.exists():
+        tmppath.unlink()
+    layers = rows = 0
+    connection = sqlite3.connect(str(tmppath))
+    try:
+        with connection:
+            for sql in SCHEMA:
+                connection.execute(sql)
+            for path in sources:
+                data = load_yaml_file(path) or {}
+                if not isinstance(data, dict):
+                    raise HieraConfigError("data file should contain a hash; file={0}".format(path))
+                layer = path.relative_to(datadir).as_posix()
+                connection.execute('INSERT INTO layers (layer) VALUES (?)', (layer,))
+                connection.executemany('INSERT INTO data (layer, key, value) VALUES (?, ?, ?)', (
+                    (layer, encode_key(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+                    for key, value in data.items()
+                ))
+                layers += 1
+                rows += len(data)
+            for sql in INDEXES:
+                connection.execute(sql)
+    except BaseException:
+        connection.close()
+        tmppath.unlink()
+        raise
+    connection.close()
+    tmppath.replace(database)
+    return layers, rows
+
+
+class HieraSqliteItem(HieraDataItem):
+    """ データベースにある 1 レイヤ; 値は key ごとに問い合わせる
+    """
+    __slots__ = ('database', 'layer')
+    indexed = True
+
+    def __init__(self, backend, database, layer, num=0, path=None, stamp=None):
+        super().__init__(backend, None, num=num, path=path, stamp=stamp)
+        self.database = database
+        self.layer = layer
+
+    def __getitem__(self, key):
+        value = self.database.get(self.layer, key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return iter(self.database.keys(self.layer))
+
+    def __len__(self):
+        return self.database.count(self.layer)
+
+    def __contains__(self, key):
+        return self.database.contains(self.layer, key)
+
+    def get(self, key, default=None):
+        return self.database.get(self.layer, key, default)
+
+    def keys(self):
+        return collections.abc.KeysView(self)
+
+    def items(self):
+        return self.database.items(self.layer)
+
+    def values(self):
+        return [value for key, value in self.items()]
+
+
+class HieraSqlitePaths(backend_yaml_data.HieraYamlPaths):
+    name = 'paths'
+    indexed = True
+    database_path = None                # HieraBackend.create() で設定する
+
+    def layer(self, realpath):
+        """ realpath のデータベース上のレイヤ名 (datadir からの相対パス)
+        """
+        return realpath.relative_to(self.hiera.base_dir.joinpath(self.datadir)).as_posix()
+
+    def stamp(self, realpath):
+        return file_stamp(self.database_path)
+
+    def sources(self):
+        return [self.database_path] + super().sources()
+
+    def load_item(self, num, realpath, database):
+        logger.debug('opened %s in %s', realpath, database.path)
+        return HieraSqliteItem(self, database, self.layer(realpath), num=num, path=realpath, stamp=database.stamp)
+
+    def reload_item(self, num, realpath):
+        return self.load_item(num, realpath, open_database(self.database_path))
+
+    def load(self):
+        """ HieraSqliteItem の列を返す; レイヤの値はここでは読まない
+        """
+        database = open_database(self.database_path)
+        return [self.load_item(num, realpath, database) for num, realpath in self.targets()]
+
+
+class HieraSqlitePath(HieraSqlitePaths):
+    name = 'path'
+
+    def __init__(self, hiera, args, name=None, datadir=None, data_hash=None, context=None):
+        super().__init__(hiera, [args], name=name, datadir=datadir, data_hash=data_hash, context=context)
+
+
+class HieraSqliteGlobs(HieraSqlitePaths):
+    name = 'globs'
+
+    def targets(self):
+        datadir = self.hiera.base_dir.joinpath(self.datadir)
+        layers = open_database(self.database_path).layers
+        for num, pattern in enumerate(self.args):
+            prefix, regex, depth = compile_pattern(self.resolve_str(pattern))
+            start = prefix + '/' if prefix else ''
+            for layer in layers:
+                if layer.startswith(start) and regex.match(layer[len(start):]):
+                    yield num, datadir.joinpath(layer)
+
+
+class HieraSqliteGlob(HieraSqliteGlobs):
+    name = 'glob'
+
+    def __init__(self, hiera, args, name=None, datadir=None, data_hash=None, context=None):
+        super().__init__(hiera, [args], name=name, datadir=datadir, data_hash=data_hash, context=context)
+
+
+class HieraBackend(backend_yaml_data.HieraBackend):
+    """ `pyhiera import-sqlite` で datadir を取り込んだデータベースを読むバックエンド
+
+    .hierarchy の項目は yaml_data と同じで、options.database にデータベースのパス
+    (設定ファイルからの相対パス; 既定は datadir + SUFFIX) を指定できる。
+    """
+    name = 'sqlite_data'
+
+    BACKEND_CLASSES = [
+        HieraSqlitePaths,
+        HieraSqlitePath,
+        HieraSqliteGlobs,
+        HieraSqliteGlob,
+    ]
+
+    @classmethod
+    def create(self, hiera, name=None, datadir=None, data_hash=None, context=None, options=None, **kwargs):
+        assert isinstance(options or {}, dict), (
+            "hiera config member '{name}' of entry 'hierarchy' expects a hash for key 'options'"
+            "; config={hiera.config_file}".format(
+                name=self.name,
+                hiera=hiera,
+            )
+        )
+        options = dict(options or {})
+        database = options.pop('database', None) or datadir.rstrip('/') + SUFFIX
+        assert not options, (
+            "hiera config member '{name}' of entry 'hierarchy' has unrecognized options: {0}"
+            "; config={hiera.config_file}".format(
+                ' '.join(options.keys()),
+                name=self.name,
+                hiera=hiera,
+            )
+        )
+        backend = super().create(hiera, name=name, datadir=datadir, data_hash=data_hash, context=context, **kwargs)
+        backend.database_path = hiera.base_dir.joinpath(database)
+        return backend
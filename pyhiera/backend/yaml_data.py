@@ -1,13 +1,16 @@
+import functools
+import logging
 import re
 import pprint
 # from pyhiera.exceptions import HieraConfigError
+from pyhiera.cache import file_stamp
 from pyhiera.hieradata import HieraDataItem
-from pyhiera.log import logger
-from pyhiera.yaml import load_yaml
+from pyhiera.log import TRACE, logger, data_summary
 
 
 class HieraYamlPaths:
     name = 'paths'
+    indexed = False                         # True ならレイヤはファイルを解析せず key ごとに問い合わせる
 
     def __init__(self, hiera, args, name=None, datadir=None, data_hash=None, context=None):
         self.hiera = hiera
@@ -21,50 +24,110 @@ class HieraYamlPaths:
     CHAR_LB = chr(ord('{') & 0x1f)         # '\x1b'
     CHAR_RB = chr(ord('}') & 0x1f)         # '\x1d'
     TRANS_BRACES = str.maketrans('{}', ''.join([CHAR_LB, CHAR_RB]))
+    MARK_INTERPOLATE = '%{'
+
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def compile_str(cls, value):
+        """ '%{var}' を含む文字列を str.format() のテンプレートに変換する
+        """
+        ret = value.translate(cls.TRANS_BRACES)
+        ret = cls.RE_INTERPOLATE.sub('{\g<1>}', ret)  # noqa: W605
+        return ret.replace(cls.CHAR_LB, '{{').replace(cls.CHAR_RB, '}}')
 
     def resolve_str(self, value):
-        ret = value.translate(self.TRANS_BRACES)
-        ret = self.RE_INTERPOLATE.sub('{\g<1>}', ret)  # noqa: W605
-        ret = ret.replace(self.CHAR_LB, '{{').replace(self.CHAR_RB, '}}')
-        return ret.format(**self.context)
+        if self.MARK_INTERPOLATE not in value:
+            return value
+        return self.compile_str(value).format(**self.context)
 
     def resolve_data(self, value):
+        """ value を補間する; 補間で変わる値を含まない dict/list は複製せずにそのまま返す
+        """
         if isinstance(value, str):
             return self.resolve_str(value)
 
         if isinstance(value, list):
-            return [self.resolve_data(el) for el in value]
+            for num, el in enumerate(value):
+                resolved = self.resolve_data(el)
+                if resolved is not el:
+                    ret = value[:num]
+                    ret.append(resolved)
+                    ret.extend(self.resolve_data(el) for el in value[num + 1:])
+                    return ret
+            return value
 
         if isinstance(value, dict):
-            return {
-                key: self.resolve_data(val)
-                for key, val in value.items()
-            }
+            ret = None
+            for key, val in value.items():
+                resolved = self.resolve_data(val)
+                if resolved is not val:
+                    if ret is None:
+                        ret = value.copy()
+                    ret[key] = resolved
+            return value if ret is None else ret
         return value
 
-    def load(self):
+    def load_files(self, realpaths):
+        return self.hiera.load_files(realpaths)
+
+    def load_item(self, num, realpath, data, stamp=None):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('loaded %(path)s size=%(size)s keys=%(keys)s', data_summary(realpath, data))
+            if logger.isEnabledFor(TRACE):
+                logger.log(TRACE, 'data=%s', pprint.pformat(data))
+        return HieraDataItem(self, data or {}, num=num, path=realpath, stamp=stamp)
+
+    def reload_item(self, num, realpath):
+        """ realpath を (この plan で読んだものを使わずに) 読み直したレイヤを返す
+        """
+        stamp = self.stamp(realpath)
+        data, = self.hiera.load_files([realpath])
+        return self.load_item(num, realpath, data, stamp=stamp)
+
+    def stamp(self, realpath):
+        """ レイヤ realpath の変更を検出するためのスタンプ; HieraData.refresh() で読み込んだときのものと比べる
+        """
+        return file_stamp(realpath)
+
+    def sources(self):
+        """ このレベルの結果が依存するファイルの列
+        """
+        return [realpath for num, realpath in self.targets()]
+
+    def targets(self):
+        """ 読み込むデータファイルを (番号, パス) の列で得る
+        """
         for num, path in enumerate(self.args):
             resolved = self.resolve_str(path)
-            realpath = self.hiera.base_dir.joinpath(self.datadir, resolved)
-            logger.debug('realpath={}'.format(realpath))
-            try:
-                with realpath.open('r') as fp:
-                    data = load_yaml(fp)
-            except IOError:
-                data = {}
-            logger.debug('data={}'.format(pprint.pformat(data)))
-            data_item = HieraDataItem(self, num=num, path=realpath)
-            data_item.update(data or {})
-            yield data_item
+            yield num, self.hiera.base_dir.joinpath(self.datadir, resolved)
+
+    def load(self):
+        """ HieraDataItem の列を返す; ファイルの読み込みはこの呼び出しの時点で始まる
+        """
+        stats = self.hiera.stats
+        if stats is None:
+            targets = list(self.targets())
+        else:
+            with stats.timer('targets', self.name):
+                targets = list(self.targets())
+        # スタンプは読み込みの前に得る (読み込み中に変わったファイルは次の HieraData.refresh() で読み直す)
+        stamps = [self.stamp(realpath) for num, realpath in targets]
+        data_list = self.load_files([realpath for num, realpath in targets])
+        items = (
+            self.load_item(num, realpath, data, stamp=stamp)
+            for (num, realpath), stamp, data in zip(targets, stamps, data_list)
+        )
+        return items if stats is None else stats.timed_iter('level', self.name, items)
 
     @property
     def data(self):
+        """ 読み込んだレイヤの列; 値の補間は lookup 時に HieraDataItem.resolve() で行う
+        """
         try:
             return self._data
         except AttributeError:
             pass
-        data = self.load()
-        ret = self._data = self.resolve_data(list(data))
+        ret = self._data = list(self.load())
         return ret
 
 
@@ -78,21 +141,11 @@ class HieraYamlPath(HieraYamlPaths):
 class HieraYamlGlobs(HieraYamlPaths):
     name = 'globs'
 
-    def load(self):
+    def targets(self):
         for num, path in enumerate(self.args):
             resolved = self.resolve_str(path)
-            for realpath in self.hiera.base_dir.joinpath(self.datadir).glob(resolved):
-                logger.debug('realpath={}'.format(realpath))
-                try:
-                    with realpath.open('r') as fp:
-                        data = load_yaml(fp)
-                except IOError:
-                    data = {}
-
-                logger.debug('data={}'.format(pprint.pformat(data)))
-                data_item = HieraDataItem(self, num=num, path=realpath)
-                data_item.update(data or {})
-                yield data_item
+            for realpath in self.hiera.glob(self.hiera.base_dir.joinpath(self.datadir), resolved):
+                yield num, realpath
 
 
 class HieraYamlGlob(HieraYamlGlobs):
@@ -0,0 +1,115 @@
+import collections
+import os
+import threading
+
+from .yaml import load_yaml
+
+
+class YamlCache:
+    """ 解析済みの YAML ドキュメントを保持するプロセス内キャッシュ
+
+    エントリは実パスをキーとし (mtime, size, inode) が一致する間だけ有効。
+    max_entries または max_bytes (ファイルサイズの合計) を超えると最も古く使われたものから捨てる。
+    """
+    MISSING = object()
+
+    def __init__(self, max_entries=1024, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{0.__module__}.{0.__name__} entries={1} bytes={self.total_bytes} hits={self.hits} misses={self.misses}>'.format(
+            self.__class__,
+            len(self.entries),
+            self=self,
+        )
+
+    @staticmethod
+    def stamp(st):
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def load(self, path):
+        """ path の YAML を解析した結果を返す; ファイルが変わっていなければキャッシュを使う
+        """
+        key = os.path.realpath(path)
+        with open(key, 'r') as fp:
+            stamp = self.stamp(os.fstat(fp.fileno()))
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] == stamp:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self.misses += 1
+            data = load_yaml(fp)
+
+        with self.lock:
+            self.store(key, stamp, data)
+        return data
+
+    def lookup(self, path):
+        """ path のキャッシュを引いて (キー, スタンプ, データ) を返す; 無効なら データは MISSING
+        """
+        key = os.path.realpath(path)
+        try:
+            stamp = self.stamp(os.stat(key))
+        except OSError:
+            return key, None, None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return key, stamp, entry[1]
+            self.misses += 1
+        return key, stamp, self.MISSING
+
+    def put(self, key, stamp, data):
+        with self.lock:
+            self.store(key, stamp, data)
+
+    def store(self, key, stamp, data):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[0][1]
+        size = stamp[1]
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (stamp, data)
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, (old_stamp, _) = self.entries.popitem(last=False)
+            self.total_bytes -= old_stamp[1]
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def file_stamp(path):
+    """ path の (mtime, size, inode); ファイルがなければ None
+    """
+    try:
+        return YamlCache.stamp(os.stat(path))
+    except OSError:
+        return None
+
+
+default_cache = YamlCache()
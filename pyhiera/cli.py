@@ -1,15 +1,19 @@
+import os
 import sys
 import argparse
-import json
-from .yaml import dump_yaml
 
 from . import __version__
-from .hiera import Hiera
+from .exceptions import HieraConfigError
+
+# pyhiera --version などを速く起動するため、yaml, json やバックエンドは使うときに import する
+
+MERGE_STRATEGIES = ('first', 'hash', 'unique', 'deep')     # HieraData.STRATEGY_METHOD の key
 
 
 class Command:
     VERSION = __version__
     PROG = 'pyhiera'
+    SUBCOMMANDS = {}
 
     @classmethod
     def main(cls):
@@ -20,23 +24,75 @@ class Command:
 
     def create_parser(self, prog=None):
         parser = argparse.ArgumentParser(prog=prog or getattr(self, 'PROG', None))
-        parser.set_defaults(output_handler=self.output_json)
+        parser.set_defaults(output_format='json')
 
         parser.add_argument(
             'config_file', action='store',
             metavar='CONFIG_FILE'
         )
         parser.add_argument(
-            '--json', '-j', action='store_const', dest='output_handler',
-            const=self.output_json,
+            'keys', action='store', nargs='*',
+            metavar='KEY',
+            help="look up only these keys instead of flattening the whole hierarchy",
+        )
+        parser.add_argument(
+            '--merge', '-m', action='store', dest='strategy', default=None,
+            choices=MERGE_STRATEGIES,
+            help="merge strategy for KEY (default: lookup_options or 'first')",
+            )
+        parser.add_argument(
+            '--json', '-j', action='store_const', dest='output_format',
+            const='json',
             )
         parser.add_argument(
-            '--yaml', '-y', action='store_const', dest='output_handler',
-            const=self.output_yaml,
+            '--yaml', '-y', action='store_const', dest='output_format',
+            const='yaml',
+            )
+        parser.add_argument(
+            '--ndjson', action='store_const', dest='output_format',
+            const='ndjson',
+            help="output one JSON object {\"key\": KEY, \"value\": VALUE} per line",
+            )
+        parser.add_argument(
+            '--stream', action='store_true',
+            help="look up and write one top-level key at a time instead of building the whole tree",
+            )
+        parser.add_argument(
+            '--sort', action='store_true',
+            help="with --stream, write keys in sorted order instead of hierarchy order",
             )
         parser.add_argument(
             '--environment', '-e', action='store', default='local',
             )
+        parser.add_argument(
+            '--workers', '-w', action='store', type=int, default=None,
+            metavar='N',
+            help="load data files concurrently with N workers",
+            )
+        parser.add_argument(
+            '--process-pool', action='store_const', dest='executor',
+            const='process', default='thread',
+            help="parse data files in worker processes instead of threads (with --workers)",
+            )
+        parser.add_argument(
+            '--stats', action='store_true',
+            help="print a breakdown of load and lookup timings to stderr",
+            )
+        parser.add_argument(
+            '--result-cache', action='store', default=os.environ.get('PYHIERA_RESULT_CACHE'),
+            metavar='DIR',
+            help="reuse flattened results cached in DIR while config, context and data files are unchanged"
+            " (default: $PYHIERA_RESULT_CACHE)",
+            )
+        parser.add_argument(
+            '--server', action='store', dest='server_socket', default=os.environ.get('PYHIERA_SERVER'),
+            metavar='SOCKET',
+            help="ask a running 'pyhiera serve' on SOCKET instead of loading data (default: $PYHIERA_SERVER)",
+            )
+        parser.add_argument(
+            '--verbose', '-v', action='count', dest='verbosity', default=0,
+            help="log a summary of each loaded data file (-vv: also log its contents)",
+            )
         parser.add_argument(
             '--traceback', action='store_true',
             help="traceback on exception",
@@ -53,8 +109,14 @@ class Command:
         parser.print_usage()
 
     def run_from_argv(self, argv):
+        subcommand = self.SUBCOMMANDS.get(argv[1]) if len(argv) > 1 else None
+        if subcommand is not None:
+            return subcommand().run_from_argv(argv[1:])
+
         parser = self.create_parser()
-        options = parser.parse_args(argv[1:])
+        # KEY ... の前後にオプションを置けるようにする (parse_intermixed_args は python 3.7 以降)
+        parse_args = getattr(parser, 'parse_intermixed_args', parser.parse_args)
+        options = parse_args(argv[1:])
         kwargs = options.__dict__
         args = kwargs.pop('args', [])
         return self.execute(*args, **kwargs)
@@ -63,6 +125,10 @@ class Command:
         self.stdout = options.pop('stdout', sys.stdout)
         self.stderr = options.pop('stderr', sys.stderr)
         self.traceback = options.pop('traceback', False)
+        verbosity = options.pop('verbosity', 0)
+        if verbosity:
+            from . import log
+            log.configure(verbosity)
         try:
             return self.handle(*args, **options)
         except Exception as err:
@@ -75,23 +141,346 @@ class Command:
 
     def handle(self, *args,
                config_file=None,
+               keys=None,
+               strategy=None,
                environment=None,
-               output_handler=None,
+               output_format=None,
+               stream=False,
+               sort=False,
+               workers=None,
+               executor=None,
+               server_socket=None,
+               stats=False,
+               result_cache=None,
                **options):
 
         context = {
             'environment': environment,
         }
-        hiera = Hiera.load_data(config_file, context=context)
-        hiera_dict = hiera.flatten()
+        if server_socket:
+            from . import client
+            hiera_dict = client.request(server_socket, config_file, context=context, keys=keys, strategy=strategy)
+        else:
+            from .hiera import Hiera
+            hiera = Hiera.load_data(
+                config_file, context=context,
+                workers=workers, executor=executor, stats=stats, result_cache=result_cache,
+            )
+            if stream and not keys:
+                getattr(self, 'stream_{}'.format(output_format))(hiera.iter_flatten(sort=sort))
+                hiera_dict = None
+            else:
+                hiera_dict = hiera.select(keys, strategy=strategy) if keys else hiera.flatten()
 
-        output_handler(hiera_dict)
+        if hiera_dict is not None:
+            getattr(self, 'output_{}'.format(output_format))(hiera_dict)
+        if stats and not server_socket:
+            self.stderr.write(hiera.hiera.stats.report())
 
     def output_json(self, data, outfile=None):
+        import json
         outfile = outfile or self.stdout
         json.dump(data, outfile, indent=2)
         outfile.write("\n")
 
     def output_yaml(self, data, outfile=None):
+        from .yaml import dump_yaml
         outfile = outfile or self.stdout
         dump_yaml(data, stream=outfile, explicit_start=True)
+
+    def output_ndjson(self, data, outfile=None):
+        self.stream_ndjson(data.items(), outfile=outfile)
+
+    def stream_json(self, items, outfile=None):
+        """ (key, 値) の列を output_json() と同じ形式で一つずつ書き出す
+        """
+        import json
+        outfile = outfile or self.stdout
+        sep = '{\n'
+        for key, value in items:
+            outfile.write(sep)
+            outfile.write('  {}: {}'.format(
+                json.dumps(key if isinstance(key, str) else json.dumps(key)),
+                json.dumps(value, indent=2).replace('\n', '\n  '),
+            ))
+            sep = ',\n'
+        outfile.write('{}\n' if sep == '{\n' else '\n}\n')
+
+    def stream_yaml(self, items, outfile=None):
+        """ (key, 値) の列を一つずつ YAML の mapping の要素として書き出す
+        """
+        from .yaml import dump_yaml
+        outfile = outfile or self.stdout
+        empty = True
+        for key, value in items:
+            dump_yaml({key: value}, stream=outfile, explicit_start=empty)
+            empty = False
+        if empty:
+            dump_yaml({}, stream=outfile, explicit_start=True)
+
+    def stream_ndjson(self, items, outfile=None):
+        import json
+        outfile = outfile or self.stdout
+        for key, value in items:
+            json.dump({'key': key, 'value': value}, outfile)
+            outfile.write("\n")
+
+
+class ServeCommand(Command):
+    PROG = 'pyhiera serve'
+
+    def create_parser(self, prog=None):
+        from . import client
+        parser = argparse.ArgumentParser(prog=prog or getattr(self, 'PROG', None))
+        parser.add_argument(
+            '--socket', '-s', action='store', default=None,
+            metavar='SOCKET',
+            help="unix socket to listen on (default: $PYHIERA_SERVER or {})".format(client.default_socket_path()),
+            )
+        parser.add_argument(
+            '--poll-interval', action='store', type=float, default=1.0,
+            metavar='SECONDS',
+            help="minimum interval between checks of data files for changes",
+            )
+        parser.add_argument(
+            '--workers', '-w', action='store', type=int, default=None,
+            metavar='N',
+            help="load data files concurrently with N workers",
+            )
+        parser.add_argument(
+            '--traceback', action='store_true',
+            help="traceback on exception",
+            )
+        return parser
+
+    def handle(self, *args,
+               socket=None,
+               poll_interval=None,
+               workers=None,
+               **options):
+        from . import client, server
+        socket_path = socket or os.environ.get('PYHIERA_SERVER') or client.default_socket_path()
+        state = server.HieraServerState(poll_interval=poll_interval, workers=workers)
+        with server.HieraServer(socket_path, state=state) as daemon:
+            self.stderr.write("listening on {}\n".format(socket_path))
+            daemon.serve_forever()
+
+
+class CompileCommand(Command):
+    PROG = 'pyhiera compile'
+
+    def create_parser(self, prog=None):
+        from .snapshot import HieraSnapshot
+        parser = argparse.ArgumentParser(prog=prog or getattr(self, 'PROG', None))
+        parser.add_argument(
+            'config_file', action='store',
+            metavar='CONFIG_FILE'
+        )
+        parser.add_argument(
+            '--output', '-o', action='store', default=None,
+            metavar='SNAPSHOT',
+            help="snapshot file to write (default: CONFIG_FILE{})".format(HieraSnapshot.SUFFIX),
+            )
+        parser.add_argument(
+            '--traceback', action='store_true',
+            help="traceback on exception",
+            )
+        return parser
+
+    def handle(self, *args,
+               config_file=None,
+               output=None,
+               **options):
+        from .hiera import Hiera
+        from .snapshot import HieraSnapshot
+        plan = Hiera(config_file, snapshot=False).compile()
+        path = HieraSnapshot.write(plan, path=output)
+        self.stderr.write("wrote {}\n".format(path))
+
+
+class ExplainCommand(Command):
+    PROG = 'pyhiera explain'
+
+    def create_parser(self, prog=None):
+        parser = argparse.ArgumentParser(prog=prog or getattr(self, 'PROG', None))
+        parser.set_defaults(output_format='json')
+        parser.add_argument(
+            'config_file', action='store',
+            metavar='CONFIG_FILE'
+        )
+        parser.add_argument(
+            'keys', action='store', nargs='*',
+            metavar='KEY',
+            help="keys to explain (default: every key of the flattened hierarchy)",
+        )
+        parser.add_argument(
+            '--merge', '-m', action='store', dest='strategy', default=None,
+            choices=MERGE_STRATEGIES,
+            help="merge strategy for KEY (default: lookup_options or 'first')",
+            )
+        parser.add_argument(
+            '--json', '-j', action='store_const', dest='output_format',
+            const='json',
+            )
+        parser.add_argument(
+            '--yaml', '-y', action='store_const', dest='output_format',
+            const='yaml',
+            )
+        parser.add_argument(
+            '--environment', '-e', action='store', default='local',
+            )
+        parser.add_argument(
+            '--traceback', action='store_true',
+            help="traceback on exception",
+            )
+        return parser
+
+    def handle(self, *args,
+               config_file=None,
+               keys=None,
+               strategy=None,
+               environment=None,
+               output_format=None,
+               **options):
+        context = {
+            'environment': environment,
+        }
+        from .hiera import Hiera
+        hiera = Hiera.load_data(config_file, context=context)
+        if keys:
+            result = {key: hiera.lookup(key, strategy=strategy, explain=True) for key in keys}
+        else:
+            result = dict(hiera.explain_all())
+        getattr(self, 'output_{}'.format(output_format))(result)
+
+
+class DiffCommand(Command):
+    PROG = 'pyhiera diff'
+    CELL_WIDTH = 40
+
+    def create_parser(self, prog=None):
+        parser = argparse.ArgumentParser(prog=prog or getattr(self, 'PROG', None))
+        parser.set_defaults(output_format='table')
+        parser.add_argument(
+            'config_file', action='store',
+            metavar='CONFIG_FILE'
+        )
+        parser.add_argument(
+            '--environment', '-e', action='append', dest='environments', default=[],
+            metavar='ENVIRONMENT',
+            help="environment to compare; repeat for each environment",
+            )
+        parser.add_argument(
+            '--contexts', '-c', action='store', default=None,
+            metavar='FILE',
+            help="YAML file with a list (or a mapping by name) of contexts to compare"
+            "; combined with every --environment when both are given",
+            )
+        parser.add_argument(
+            '--all', '-a', action='store_true', dest='all_keys',
+            help="show every key, not only keys whose values differ",
+            )
+        parser.add_argument(
+            '--table', '-t', action='store_const', dest='output_format',
+            const='table',
+            )
+        parser.add_argument(
+            '--json', '-j', action='store_const', dest='output_format',
+            const='json',
+            )
+        parser.add_argument(
+            '--yaml', '-y', action='store_const', dest='output_format',
+            const='yaml',
+            )
+        parser.add_argument(
+            '--workers', '-w', action='store', type=int, default=None,
+            metavar='N',
+            help="merge contexts in N worker processes",
+            )
+        parser.add_argument(
+            '--traceback', action='store_true',
+            help="traceback on exception",
+            )
+        return parser
+
+    def handle(self, *args,
+               config_file=None,
+               environments=None,
+               contexts=None,
+               all_keys=False,
+               output_format=None,
+               workers=None,
+               **options):
+        from . import diff
+        from .hiera import Hiera
+        contexts = diff.build_contexts(environments, diff.load_contexts(contexts) if contexts else None)
+        if len(contexts) < 2:
+            raise HieraConfigError("diff needs at least two contexts (-e ENVIRONMENT or --contexts FILE)")
+        plan = Hiera(config_file).compile()
+        results = plan.evaluate_many(contexts.values(), flatten=True, workers=workers)
+        matrix = diff.diff_matrix(dict(zip(contexts, results)), all_keys=all_keys)
+        if output_format == 'table':
+            self.output_table(matrix, list(contexts))
+        else:
+            getattr(self, 'output_{}'.format(output_format))(matrix)
+
+    def format_cell(self, row, label):
+        import json
+        if label not in row:
+            return '-'
+        value = json.dumps(row[label], sort_keys=True)
+        if len(value) > self.CELL_WIDTH:
+            value = value[:self.CELL_WIDTH - 3] + '...'
+        return value
+
+    def output_table(self, matrix, labels, outfile=None):
+        """ key を行、コンテキストを列にした表を書き出す; key がないコンテキストは '-'
+        """
+        outfile = outfile or self.stdout
+        rows = [['KEY'] + labels] + [
+            [str(key)] + [self.format_cell(row, label) for label in labels]
+            for key, row in matrix.items()
+        ]
+        widths = [max(len(row[num]) for row in rows) for num in range(len(labels) + 1)]
+        for row in rows:
+            outfile.write('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() + '\n')
+
+
+class ImportSqliteCommand(Command):
+    PROG = 'pyhiera import-sqlite'
+
+    def create_parser(self, prog=None):
+        parser = argparse.ArgumentParser(prog=prog or getattr(self, 'PROG', None))
+        parser.add_argument(
+            'datadir', action='store',
+            metavar='DATADIR',
+            help="datadir of YAML data files to import",
+        )
+        parser.add_argument(
+            '--output', '-o', action='store', default=None,
+            metavar='DATABASE',
+            help="SQLite database to write for the 'sqlite_data' backend (default: DATADIR.sqlite3)",
+            )
+        parser.add_argument(
+            '--traceback', action='store_true',
+            help="traceback on exception",
+            )
+        return parser
+
+    def handle(self, *args,
+               datadir=None,
+               output=None,
+               **options):
+        from .backend import sqlite_data
+        path = output or datadir.rstrip('/') + sqlite_data.SUFFIX
+        layers, rows = sqlite_data.import_datadir(datadir, path)
+        self.stderr.write("wrote {} ({} layers, {} keys)\n".format(path, layers, rows))
+
+
+Command.SUBCOMMANDS.update({
+    'serve': ServeCommand,
+    'compile': CompileCommand,
+    'explain': ExplainCommand,
+    'diff': DiffCommand,
+    'import-sqlite': ImportSqliteCommand,
+})
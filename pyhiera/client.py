@@ -0,0 +1,38 @@
+import json
+import os
+import socket
+
+from .exceptions import HieraError
+
+
+class HieraServerError(HieraError):
+    pass
+
+
+def default_socket_path():
+    return os.path.join(
+        os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+        'pyhiera-{}.sock'.format(os.getuid()),
+    )
+
+
+def request(socket_path, config_file, context=None, keys=None, strategy=None):
+    """ socket_path で待ち受けているサーバに lookup を要求する
+
+    keys を指定すれば HieraData.select() の、しなければ flatten() の結果を得る。
+    """
+    payload = {
+        'config': os.path.abspath(config_file),
+        'context': context or {},
+        'keys': keys or [],
+        'strategy': strategy,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as fp:
+            fp.write(json.dumps(payload).encode('utf-8') + b'\n')
+            fp.flush()
+            result = json.loads(fp.readline().decode('utf-8'))
+    if 'error' in result:
+        raise HieraServerError(result['error'])
+    return result['data']
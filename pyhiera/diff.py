@@ -0,0 +1,58 @@
+from .exceptions import HieraConfigError
+
+
+def context_label(context):
+    """ コンテキストを表に出すときの名前 (例: "environment=prod,role=web")
+    """
+    return ','.join('{}={}'.format(key, value) for key, value in context.items())
+
+
+def load_contexts(path):
+    """ コンテキストの一覧を書いた YAML (JSON) ファイル path を {名前: コンテキスト} にする
+
+    ファイルはコンテキスト (mapping) の列か、名前からコンテキストへの mapping。
+    """
+    from .yaml import load_yaml
+    with open(path, 'r') as fp:
+        data = load_yaml(fp)
+    contexts = data if isinstance(data, list) else list(data.values()) if isinstance(data, dict) else None
+    if not contexts or not all(isinstance(context, dict) for context in contexts):
+        raise HieraConfigError(
+            "context file should be a list or a mapping of contexts; file={}".format(path)
+        )
+    if isinstance(data, list):
+        data = {context_label(context): context for context in data}
+    return {str(label): context for label, context in data.items()}
+
+
+def build_contexts(environments=None, matrix=None):
+    """ environment の値の列と {名前: コンテキスト} から {名前: コンテキスト} を作る
+
+    両方を指定すれば、matrix の各コンテキストと各 environment の組み合わせすべてになる。
+    """
+    environments = environments or []
+    if not matrix:
+        return {env: {'environment': env} for env in environments}
+    if not environments:
+        return dict(matrix)
+    ret = {}
+    for env in environments:
+        for label, context in matrix.items():
+            ret['{}:{}'.format(env, label)] = dict(context, environment=env)
+    return ret
+
+
+def diff_matrix(results, all_keys=False):
+    """ {名前: flatten() の結果} から key ごとの {名前: 値} を作る
+
+    all_keys でなければ、コンテキストによって値が異なるか、一部のコンテキストにしかない key だけを返す。
+    key がないコンテキストは行に含めない。
+    """
+    keys = sorted(set().union(*results.values()), key=str)
+    ret = {}
+    for key in keys:
+        row = {label: result[key] for label, result in results.items() if key in result}
+        values = list(row.values())
+        if all_keys or len(row) < len(results) or any(value != values[0] for value in values[1:]):
+            ret[key] = row
+    return ret
@@ -0,0 +1,146 @@
+import os
+import pathlib
+import re
+import threading
+
+from .exceptions import HieraConfigError
+
+
+def translate_segment(segment):
+    """ glob のパスの 1 要素を '/' をまたがない正規表現にする
+    """
+    ret = []
+    pos = 0
+    while pos < len(segment):
+        char = segment[pos]
+        if char == '*':
+            ret.append('[^/]*')
+        elif char == '?':
+            ret.append('[^/]')
+        elif char == '[':
+            end = segment.find(']', pos + 2)
+            if end < 0:
+                ret.append(re.escape(char))
+            else:
+                body = segment[pos + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                ret.append('[{}]'.format(body.replace('\\', '\\\\')))
+                pos = end
+        else:
+            ret.append(re.escape(char))
+        pos += 1
+    return ''.join(ret)
+
+
+GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+def compile_pattern(pattern):
+    """ pathlib.Path.glob() 形式のパターンを (先頭の固定部分, 残りの正規表現, 探索する深さ) にする
+
+    固定部分はワイルドカードを含まない先頭の要素を '/' でつないだもの (なければ '')。
+    正規表現と深さは固定部分より下の相対パスについてのもので、'**' を含めば深さは None。
+    Path.glob() と違い、ファイルだけにマッチするので末尾の '**' は受け付けない。
+    """
+    segments = [seg for seg in pattern.split('/') if seg not in ('', '.')]
+    if segments and segments[-1] == '**':
+        raise HieraConfigError("glob pattern must not end with '**': '{0}'".format(pattern))
+    fixed = 0
+    while fixed < len(segments) - 1 and not GLOB_CHARS.search(segments[fixed]):
+        fixed += 1
+    prefix = '/'.join(segments[:fixed])
+    segments = segments[fixed:]
+    regex = ''
+    for seg in segments[:-1]:
+        regex += '(?:[^/]+/)*' if seg == '**' else translate_segment(seg) + '/'
+    regex += translate_segment(segments[-1] if segments else '')
+    depth = None if '**' in segments else len(segments)
+    return prefix, re.compile(regex + r'\Z'), depth
+
+
+class DirectoryIndex:
+    """ ディレクトリの一覧のキャッシュ; glob のレベルの展開に使う
+
+    一覧はディレクトリごとに mtime が変わらない間だけ有効で、再利用するときはディレクトリを stat するだけになる。
+    glob() の結果は sorted(Path.glob()) と同じくパスの要素ごとの順に並べる。
+    """
+    def __init__(self):
+        self.listings = {}
+        self.patterns = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{0.__module__}.{0.__name__} directories={1} hits={self.hits} misses={self.misses}>'.format(
+            self.__class__,
+            len(self.listings),
+            self=self,
+        )
+
+    def listing(self, directory):
+        """ directory の (ファイル名の列, (サブディレクトリ名, シンボリックリンクか) の列) を得る
+        """
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return (), ()
+        entry = self.listings.get(directory)
+        if entry is not None and entry[0] == mtime:
+            self.hits += 1
+            return entry[1], entry[2]
+
+        self.misses += 1
+        files = []
+        dirs = []
+        try:
+            with os.scandir(directory) as it:
+                for item in it:
+                    if item.is_dir():
+                        dirs.append((item.name, item.is_symlink()))
+                    else:
+                        files.append(item.name)
+        except OSError:
+            return (), ()
+        with self.lock:
+            self.listings[directory] = (mtime, files, dirs)
+        return files, dirs
+
+    def walk(self, directory, depth, prefix=''):
+        """ directory 以下のファイルの相対パスを得る; depth が None なら (シンボリックリンクをたどらずに) すべて
+        """
+        files, dirs = self.listing(directory)
+        for name in files:
+            yield prefix + name
+        if depth is not None and depth <= 1:
+            return
+        for name, is_symlink in dirs:
+            if depth is None and is_symlink:
+                continue
+            yield from self.walk(
+                os.path.join(directory, name),
+                None if depth is None else depth - 1,
+                prefix + name + '/',
+            )
+
+    def glob(self, base_dir, pattern):
+        """ base_dir.glob(pattern) にマッチするファイルをパスの順に得る; 探索はパターンの固定部分のディレクトリから始める
+        """
+        try:
+            prefix, regex, depth = self.patterns[pattern]
+        except KeyError:
+            prefix, regex, depth = self.patterns[pattern] = compile_pattern(pattern)
+        top = pathlib.Path(base_dir).joinpath(prefix)
+        return [
+            top.joinpath(path)
+            for path in sorted(self.walk(str(top), depth), key=lambda path: path.split('/'))
+            if regex.match(path)
+        ]
+
+    def clear(self):
+        with self.lock:
+            self.listings.clear()
+
+
+default_dir_index = DirectoryIndex()
@@ -1,9 +1,16 @@
 import pathlib
+import sys
 
+from .cache import default_cache
+from .dirindex import default_dir_index
 from .exceptions import HieraConfigError
 from .hieradata import HieraData
-from .yaml import load_yaml
+from . import resultcache
+from .snapshot import HieraSnapshot
+from .stats import HieraStats
+from .yaml import load_yaml, load_yaml_file
 
+from .backend import sqlite_data as backend_sqlite_data
 from .backend import yaml_data as backend_yaml_data
 
 
@@ -11,15 +18,41 @@ class Hiera:
     HIERA_CONFIG_VERSION = 5
 
     @classmethod
-    def load_data(cls, config_file, context=None):
+    def load_data(cls, config_file, context=None, **options):
         """ hiera 設定ファイルにもとづいた lookup を行うインスタンス  HieraData を返す
         """
-        instance = cls(config_file)
+        instance = cls(config_file, **options)
         return instance.get_data(context)
 
-    def __init__(self, config_file):
+    @classmethod
+    async def aload_data(cls, config_file, context=None, **options):
+        """ load_data() のコルーチン版; 設定とデータファイルの読み込みはイベントループの外で行う
+        """
+        instance = cls(config_file, **options)
+        return await instance.aget_data(context)
+
+    EXECUTORS = {                       # concurrent.futures のクラス名; 使うときに import する
+        'thread': 'ThreadPoolExecutor',
+        'process': 'ProcessPoolExecutor',
+    }
+
+    def __init__(self, config_file, cache=None, workers=None, executor='thread', snapshot=True, stats=None,
+                 dir_index=None, result_cache=None):
         self.config_file = pathlib.PosixPath(config_file).absolute()
         self.base_dir = self.config_file.parent
+        self.cache = default_cache if cache is True else cache or None
+        if executor not in self.EXECUTORS:
+            raise HieraConfigError("unsupported executor: '{}'".format(executor))
+        self.workers = workers
+        self.executor_type = executor
+        self.use_snapshot = snapshot
+        self.stats = HieraStats() if stats is True else stats or None
+        self.dir_index = default_dir_index if dir_index is True else dir_index or None
+        if result_cache is True:
+            result_cache = resultcache.default_directory()
+        if isinstance(result_cache, (str, pathlib.PurePath)):
+            result_cache = resultcache.ResultCache(result_cache)
+        self.result_cache = result_cache or None
 
     def __repr__(self):
         return '<{0.__module__}.{0.__name__} config="{self.config_file}">'.format(
@@ -30,14 +63,39 @@ class Hiera:
     def get_data(self, context=None):
         """ hiera 設定ファイルにもとづいた lookup を行うインスタンス  HieraData を返す
         """
-        context = context or {}
+        return self.compile().evaluate(context)
+
+    async def aget_data(self, context=None):
+        """ get_data() のコルーチン版
+
+        データファイルは並行に読み込み、ほかのコルーチンが読み込み中の同じファイルはその結果を共有する。
+        """
+        import asyncio
+        from .aio import inflight_loads
+        loop = asyncio.get_event_loop()
+        plan = await loop.run_in_executor(None, self.compile)
+        data = plan.evaluate(context)
+        paths = await loop.run_in_executor(None, lambda: {
+            str(path): path
+            for backend in data.backend_list
+            if not backend.indexed
+            for num, path in backend.targets()
+        })
+        loaded = await asyncio.gather(*[inflight_loads.load(self, path) for path in paths.values()])
+        plan.files.update(zip(paths, loaded))
+        await data.aload()
+        return data
+
+    def compile(self):
+        """ hiera 設定ファイルを一度だけ解析して、コンテキストごとに評価できる HieraPlan を返す
+        """
         with open(self.config_file, 'r') as fp:
             config = load_yaml(fp)
 
         try:
             self.identify_version(config.pop('version', 0))
             defaults = self.parse_defaults(config.pop('defaults', {}))
-            backend_list = self.parse_hierarchy(config.pop('hierarchy', []), defaults, context)
+            hierarchy = self.parse_hierarchy(config.pop('hierarchy', []), defaults)
             assert not config, (
                 "hiera config has unrecognized key: {}"
                 "; config={hiera.config_file}".format(
@@ -45,13 +103,120 @@ class Hiera:
                     hiera=self,
                 )
             )
-            # data = HieraData(self, list(itertools.chain(*backend_list)))
-            data = HieraData(self, backend_list)
 
         except AssertionError as err:
             raise HieraConfigError(*err.args)
 
-        return data
+        return HieraPlan(self, hierarchy)
+
+    @property
+    def snapshot(self):
+        """ `pyhiera compile` で作った設定ファイルのスナップショット; なければ None
+        """
+        try:
+            return self._snapshot
+        except AttributeError:
+            pass
+        ret = self._snapshot = HieraSnapshot.open(self.config_file) if self.use_snapshot else None
+        return ret
+
+    def glob(self, base_dir, pattern):
+        """ base_dir 以下で glob パターン pattern にマッチするパスをパスの順に得る; dir_index が指定されていればそれを使う
+        """
+        if self.dir_index is not None:
+            return self.dir_index.glob(base_dir, pattern)
+        return sorted(base_dir.glob(pattern))
+
+    def load_file(self, path):
+        """ データファイル path を解析する
+
+        新しいスナップショットがあればその内容を使い、なければ cache (指定されていれば) を通して YAML を解析する。
+        """
+        if self.stats is None:
+            return self.parse_file(path)
+        with self.stats.timer('file', str(path)):
+            return self.parse_file(path)
+
+    def parse_file(self, path):
+        snapshot = self.snapshot
+        if snapshot is not None:
+            data = snapshot.load(path)
+            if data is not snapshot.MISSING:
+                return data
+
+        if self.cache is not None:
+            return self.cache.load(path)
+
+        stats = self.stats
+        if stats is None:
+            with open(path, 'r') as fp:
+                return load_yaml(fp)
+
+        with stats.timer('io', 'read'):
+            with open(path, 'r') as fp:
+                content = fp.read()
+        with stats.timer('parse', 'yaml'):
+            return load_yaml(content)
+
+    def try_load_file(self, path):
+        try:
+            return self.load_file(path)
+        except IOError:
+            return None
+
+    @property
+    def executor(self):
+        """ workers が指定されていればデータファイルの読み込みに使う Executor
+        """
+        try:
+            return self._executor
+        except AttributeError:
+            pass
+        if self.workers:
+            import concurrent.futures
+            ret = getattr(concurrent.futures, self.EXECUTORS[self.executor_type])(max_workers=self.workers)
+        else:
+            ret = None
+        self._executor = ret
+        return ret
+
+    def close(self):
+        executor = self.__dict__.pop('_executor', None)
+        if executor is not None:
+            executor.shutdown()
+        snapshot = self.__dict__.pop('_snapshot', None)
+        if snapshot is not None:
+            snapshot.close()
+
+    def load_files(self, paths):
+        """ データファイルの列 paths を解析した結果を paths の順に返すイテレータ; 読めないファイルは None
+
+        workers が指定されていれば、呼び出した時点ですべてのファイルの読み込みを Executor に投入する。
+        """
+        paths = list(paths)
+        if self.executor is None:
+            return (self.try_load_file(path) for path in paths)
+
+        if self.executor_type != 'process':
+            return self.executor.map(self.try_load_file, paths)
+
+        # プロセスプールには解析だけを任せ、キャッシュの参照と更新はこのプロセスで行う
+        if self.cache is None:
+            return self.executor.map(load_yaml_file, paths)
+
+        entries = [self.cache.lookup(path) for path in paths]
+        misses = [num for num, (key, stamp, data) in enumerate(entries) if data is self.cache.MISSING]
+        parsed = self.executor.map(load_yaml_file, [paths[num] for num in misses])
+        return self.collect_parsed(entries, misses, parsed)
+
+    def collect_parsed(self, entries, misses, parsed):
+        parsed = dict(zip(misses, parsed))
+        for num, (key, stamp, data) in enumerate(entries):
+            if num in parsed:
+                data = parsed[num]
+                if data is not None:
+                    self.cache.put(key, stamp, data)
+            yield data
 
     def identify_version(self, version):
         """ hiera 設定ファイルの .version を確認する
@@ -86,10 +251,11 @@ class Hiera:
 
     BACKENDS = {
         'yaml_data': backend_yaml_data.HieraBackend,
+        'sqlite_data': backend_sqlite_data.HieraBackend,
     }
 
-    def parse_hierarchy(self, conf, defaults, context):
-        """ hiera 設定ファイルの .hierarchy を解析してバックエンドのインスタンス列を得る
+    def parse_hierarchy(self, conf, defaults):
+        """ hiera 設定ファイルの .hierarchy を解析して (バックエンドのクラス, オプション) の列を得る
         """
         assert isinstance(conf, list) and conf, (
             "hiera config has wrong type, entry 'hierarchy' expects a list"
@@ -98,6 +264,7 @@ class Hiera:
             )
         )
 
+        ret = []
         for item in conf:
             assert isinstance(item, dict), (
                 "hiera config has wrong type, member of entry 'hierarchy' expects a dict"
@@ -126,4 +293,111 @@ class Hiera:
                     )
                 )
 
-            yield backend_klass.create(self, context=context, **backend_opts)
+            backend_klass.create(self, **backend_opts)      # 設定の検査だけを行う
+            ret.append((backend_klass, backend_opts))
+        return ret
+
+
+class HieraPlan:
+    """ Hiera.compile() で解析済みの hiera 設定
+
+    evaluate() を繰り返し呼んでも設定ファイルは読み直さない。
+    同じ plan から評価したコンテキストどうしは、解決後のパスが同じデータファイルの読み込みを共有する。
+    """
+    def __init__(self, hiera, hierarchy):
+        self.hiera = hiera
+        self.hierarchy = hierarchy
+        self.files = {}
+
+    def __repr__(self):
+        return '<{0.__module__}.{0.__name__} config="{hiera.config_file}">'.format(
+            self.__class__,
+            hiera=self.hiera,
+        )
+
+    def load_files(self, paths):
+        """ データファイルの列 paths を解析する; この plan で一度読んだファイルは読み直さない
+        """
+        paths = list(paths)
+        missing = {
+            str(path): path
+            for path in paths
+            if str(path) not in self.files
+        }
+        loading = self.hiera.load_files(missing.values())
+        return self.collect_files(paths, missing, loading)
+
+    def collect_files(self, paths, missing, loading):
+        self.files.update(zip(missing, loading))
+        for path in paths:
+            yield self.files[str(path)]
+
+    def create_backends(self, context):
+        for backend_klass, backend_opts in self.hierarchy:
+            backend = backend_klass.create(self.hiera, context=context, **backend_opts)
+            backend.load_files = self.load_files
+            yield backend
+
+    def evaluate(self, context=None):
+        """ context にもとづいた lookup を行うインスタンス HieraData を返す
+        """
+        context = context or {}
+        return HieraData(self.hiera, list(self.create_backends(context)), context=context)
+
+    def evaluate_many(self, contexts, flatten=False, workers=None):
+        """ contexts の各コンテキストについて HieraData (flatten=True なら flatten() の結果) の列を返す
+
+        flatten=True で workers を指定すると、データファイルはこのプロセスで一度だけ解析し、
+        コンテキストごとの merge を workers 個のプロセスに分ける。
+        """
+        contexts = list(contexts)
+        # ProcessPoolExecutor の initializer は python 3.7 以降
+        if flatten and workers and sys.version_info >= (3, 7):
+            return self.flatten_parallel(contexts, workers)
+        ret = []
+        for context in contexts:
+            data = self.evaluate(context)
+            ret.append(data.flatten() if flatten else data)
+        return ret
+
+    def reset(self):
+        """ 共有しているデータファイルの読み込み結果を捨てる
+        """
+        self.files.clear()
+
+    def preload(self, contexts):
+        """ contexts のいずれかが参照するデータファイルをまとめて解析しておく
+        """
+        paths = {}
+        for context in contexts:
+            for backend in self.evaluate(context).backend_list:
+                if backend.indexed:
+                    continue
+                for num, path in backend.targets():
+                    paths.setdefault(str(path), path)
+        for data in self.load_files(paths.values()):
+            pass
+
+    def flatten_parallel(self, contexts, workers):
+        import concurrent.futures
+        self.preload(contexts)
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_plan_worker,
+                initargs=(str(self.hiera.config_file), self.files),
+        ) as executor:
+            return list(executor.map(flatten_context, contexts))
+
+
+# プロセスプールの各ワーカーが持つ HieraPlan; 解析済みのデータファイルは親プロセスから受け取る
+worker_plan = None
+
+
+def init_plan_worker(config_file, files):
+    global worker_plan
+    worker_plan = Hiera(config_file, snapshot=False).compile()
+    worker_plan.files.update(files)
+
+
+def flatten_context(context):
+    return worker_plan.evaluate(context).flatten()
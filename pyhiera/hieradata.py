@@ -1,12 +1,22 @@
+import bisect
+import collections.abc
 import itertools
-from .exceptions import HieraConfigError
+import operator
+from .exceptions import HieraError, HieraConfigError
 
 
-class HieraDataItem(dict):
-    def __init__(self, backend, num=0, **kwargs):
+class HieraDataItem(collections.abc.Mapping):
+    """ .hierarchy の 1 レイヤ; 読み込んだデータ (dict) を複製せずに参照する読み出し専用の mapping
+    """
+    __slots__ = ('backend', 'num', 'path', 'stamp', 'data')
+    indexed = False                         # True なら HieraData は key ごとに get() で問い合わせ、索引に載せない
+
+    def __init__(self, backend, data, num=0, path=None, stamp=None):
         self.backend = backend
+        self.data = data
         self.num = num
-        self.init_kwargs = kwargs
+        self.path = path
+        self.stamp = stamp                  # 読み込んだときのデータファイルの (mtime, size, inode)
 
     def __repr__(self):
         return '<{0.__module__}.{0.__name__} config="{hiera.config_file}" name="{backend.name}" {self.num}>'.format(
@@ -16,13 +26,119 @@ class HieraDataItem(dict):
             self=self,
         )
 
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def items(self):
+        return self.data.items()
+
+    def values(self):
+        return self.data.values()
+
+    def resolve(self, value):
+        """ このレイヤの値 value を補間する
+        """
+        return self.backend.resolve_data(value)
+
+
+def fingerprint(value):
+    """ == で等しい値が等しくなるハッシュ可能な値を得る; dict/list/set 以外のハッシュ不能な値は TypeError
+    """
+    if isinstance(value, dict):
+        return (dict, frozenset((key, fingerprint(val)) for key, val in value.items()))
+    if isinstance(value, list):
+        return (list, tuple(fingerprint(el) for el in value))
+    if isinstance(value, (set, frozenset)):
+        return (set, frozenset(value))
+    hash(value)
+    return value
+
+
+class Membership:
+    """ 要素が含まれるかを == で判定する集合
+
+    ハッシュ可能な要素は set で、dict/list は fingerprint() で判定する。
+    どちらにもできない要素だけは線形に比較する。
+    """
+    def __init__(self, items=()):
+        self.hashable = set()
+        self.fingerprints = set()
+        self.others = []
+        self.update(items)
+
+    def __contains__(self, el):
+        try:
+            return el in self.hashable
+        except TypeError:
+            pass
+        try:
+            return fingerprint(el) in self.fingerprints
+        except TypeError:
+            return el in self.others
+
+    def add(self, el):
+        try:
+            self.hashable.add(el)
+            return
+        except TypeError:
+            pass
+        try:
+            self.fingerprints.add(fingerprint(el))
+        except TypeError:
+            self.others.append(el)
+
+    def update(self, items):
+        for el in items:
+            self.add(el)
+
+
+def copy_value(value):
+    """ value の dict/list/set を入れ子まで複製する; lookup() の結果がキャッシュや plan の解析結果を共有しないようにする
+    """
+    if isinstance(value, dict):
+        return {key: copy_value(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [copy_value(el) for el in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+
+def extend_unique(ret, items, members):
+    """ items のうち members に含まれない要素を ret に加え、members を更新する
+
+    items 自身の中の重複は取り除かない (list の 'el not in ret' による従来の結果と同じ)。
+    """
+    added = [el for el in items if el not in members]
+    ret.extend(added)
+    members.update(added)
+
 
 class HieraData:
     DOESNOTEXIST = object()
 
-    def __init__(self, hiera, backend_list):
+    def __init__(self, hiera, backend_list, context=None):
         self.hiera = hiera
         self.backend_list = backend_list
+        self.context = context or {}
+        self.loaded = []                    # これまでに読み込んだレイヤ
+        self.loaded_index = {}              # .loaded の key ごとの (レイヤ番号, 値) の列
+        self.indexed = []                   # .loaded のうち索引に載せないレイヤ (item.indexed) の番号
 
     def __repr__(self):
         return '<{0.__module__}.{0.__name__} config="{hiera.config_file}">'.format(
@@ -30,19 +146,123 @@ class HieraData:
             hiera=self.hiera,
         )
 
+    @property
+    def layers(self):
+        """ バックエンドからレイヤを .hierarchy の優先順に取り出すイテレータ
+        """
+        try:
+            return self._layers
+        except AttributeError:
+            pass
+        if self.hiera.workers:
+            # 並行読み込みのときは、すべてのバックエンドの load() を先に呼んで全レイヤの読み込みを一度に始める
+            loading = [backend.load() for backend in self.backend_list]
+        else:
+            loading = (backend.load() for backend in self.backend_list)
+        ret = self._layers = itertools.chain.from_iterable(loading)
+        return ret
+
+    def pull(self):
+        """ 次のレイヤを読み込んで .loaded_index に加える; 残りのレイヤがなければ False を返す
+        """
+        item = next(self.layers, None)
+        if item is None:
+            return False
+        num = len(self.loaded)
+        self.loaded.append(item)
+        if item.indexed:
+            self.indexed.append(num)
+            return True
+        for key, val in item.items():
+            self.loaded_index.setdefault(key, []).append((num, val))
+        return True
+
+    @property
+    def index(self):
+        """ すべてのレイヤについて key ごとに (レイヤ番号, 値) の列を得る
+        """
+        self.values
+        if not self.indexed:
+            return self.loaded_index
+        try:
+            return self._index
+        except AttributeError:
+            pass
+        ret = self._index = {}
+        for num, item in enumerate(self.loaded):
+            for key, val in item.items():
+                ret.setdefault(key, []).append((num, val))
+        return ret
+
+    def entries(self, key, start=0):
+        """ 読み込んだレイヤのうち start 番目以降で key を持つものの (レイヤ番号, 値) を .hierarchy の優先順に得る
+        """
+        index = self.__dict__.get('_index', self.loaded_index)     # .index を作った後はそれを使う
+        entries = index.get(key, [])
+        if start:
+            entries = [entry for entry in entries if entry[0] >= start]
+        if not self.indexed or index is not self.loaded_index:
+            return entries
+        ret = list(entries)
+        for num in self.indexed[bisect.bisect_left(self.indexed, start):]:
+            val = self.loaded[num].get(key, self.DOESNOTEXIST)
+            if val is not self.DOESNOTEXIST:
+                ret.append((num, val))
+        ret.sort(key=operator.itemgetter(0))
+        return ret
+
+    def matches(self, key):
+        """ key を持つレイヤの値を .hierarchy の優先順に得る
+        """
+        values = self.values
+        entries = self.entries(key)
+        stats = self.hiera.stats
+        if stats is None:
+            return [values[num].resolve(val) for num, val in entries]
+        with stats.timer('interpolate', 'total'):
+            return [values[num].resolve(val) for num, val in entries]
+
+    def first_entry(self, key, start=0):
+        """ 読み込んだレイヤのうち start 番目以降で最初に key を持つものの (レイヤ番号, 値); なければ None
+
+        索引に載せないレイヤには、索引で見つかったレイヤより上位のものだけを優先順に問い合わせ、見つかった時点でやめる。
+        """
+        index = self.__dict__.get('_index', self.loaded_index)
+        entries = index.get(key, ())
+        pos = bisect.bisect_left(entries, (start,))
+        found = entries[pos] if pos < len(entries) else None
+        if not self.indexed or index is not self.loaded_index:
+            return found
+        end = found[0] if found is not None else len(self.loaded)
+        for num in self.indexed[bisect.bisect_left(self.indexed, start):]:
+            if num >= end:
+                break
+            val = self.loaded[num].get(key, self.DOESNOTEXIST)
+            if val is not self.DOESNOTEXIST:
+                return num, val
+        return found
+
     def lookup_first(self, key, default=None):
         """ hiera 設定ファイルの .hierarchy から key の値を first merge で得る
+
+        key を持つレイヤが見つかった時点で、それより下位のレイヤは読み込まない。
         """
-        ret = next((item[key] for item in self.values if key in item), default)
-        return ret
+        entry = self.first_entry(key)
+        while entry is None and self.pull():
+            entry = self.first_entry(key, start=len(self.loaded) - 1)
+        if entry is None:
+            return default
+        num, val = entry
+        stats = self.hiera.stats
+        if stats is None:
+            return self.loaded[num].resolve(val)
+        with stats.timer('interpolate', 'total'):
+            return self.loaded[num].resolve(val)
 
     def lookup_hash(self, key, default=None):
         """ hiera 設定ファイルの .hierarchy から key の値を hash merge で得る
         """
-        values = list(filter(
-            lambda el: el is not self.DOESNOTEXIST,
-            (el.get(key, self.DOESNOTEXIST) for el in self.values)
-        ))
+        values = self.matches(key)
         ret = {}
         found = False
         for item in reversed(values):
@@ -60,16 +280,14 @@ class HieraData:
     def lookup_unique(self, key, default=None):
         """ hiera 設定ファイルの .hierarchy から key の値を unique merge で得る
         """
-        values = list(filter(
-            lambda el: el is not self.DOESNOTEXIST,
-            (el.get(key, self.DOESNOTEXIST) for el in self.values)
-        ))
+        values = self.matches(key)
         ret = []
+        members = Membership()
         found = False
         for item in values:
             found = True
             if isinstance(item, list):
-                ret.extend([el for el in item if el not in ret])
+                extend_unique(ret, item, members)
             elif isinstance(item, dict):
                 raise HieraConfigError(
                     "all 'unique' merged matching values must not be a hash, key: '{0}'"
@@ -78,37 +296,48 @@ class HieraData:
                         hiera=self.hiera,
                     )
                 )
-            elif item not in ret:
+            elif item not in members:
                 ret.append(item)
+                members.add(item)
 
         return ret if found else default
 
     def merge_deep(self, lval, rval):
-        if rval is self.DOESNOTEXIST:
+        """ lval に優先度の高い rval を deep merge する
+
+        lval, rval を変更せず、変わらない部分木は共有する。新しく作るのは値の異なる経路上の dict/list だけ。
+        dict の key の順序は lval の順に rval で増えた key が続く。
+        """
+        if rval is self.DOESNOTEXIST or rval is lval:
             return lval
 
         if lval is self.DOESNOTEXIST:
-            return rval.copy() if isinstance(rval, (dict, list)) else rval
+            return rval
 
         if isinstance(lval, dict) and isinstance(rval, dict):
-            return {
-                key: self.merge_deep(lval.get(key, self.DOESNOTEXIST), rval.get(key, self.DOESNOTEXIST))
-                for key in set(lval) | set(rval)
-            }
+            changed = {}
+            for key, val in rval.items():
+                lv = lval.get(key, self.DOESNOTEXIST)
+                merged = self.merge_deep(lv, val)
+                if merged is not lv:
+                    changed[key] = merged
+            if not changed:
+                return lval
+            ret = lval.copy()
+            ret.update(changed)
+            return ret
 
         if isinstance(lval, list) and isinstance(rval, list):
-            lval.extend([el for el in rval if el not in lval])
-            return lval
+            members = Membership(lval)
+            added = [el for el in rval if el not in members]
+            return lval + added if added else lval
 
         return rval
 
     def lookup_deep(self, key, default=None):
         """ hiera 設定ファイルの .hierarchy から key の値を deep merge で得る
         """
-        values = list(filter(
-            lambda el: el is not self.DOESNOTEXIST,
-            (el.get(key, self.DOESNOTEXIST) for el in self.values)
-        ))
+        values = self.matches(key)
         ret = self.DOESNOTEXIST
         found = False
         for item in reversed(values):
@@ -134,7 +363,12 @@ class HieraData:
         ret = self._looup_options = self.lookup_first('lookup_options', default={})
         return ret
 
-    def lookup(self, key, default=None, strategy=None):
+    def lookup(self, key, default=None, strategy=None, explain=False):
+        """ key の値を strategy (指定がなければ lookup_options の merge、それもなければ 'first') で得る
+
+        explain=True なら値の代わりに、値に寄与したレイヤを示す explain() の結果を返す。
+        merge は解析済みのデータを共有したまま行い、返す値は呼び出し側が変更してよい複製にする。
+        """
         strategy = strategy or self.lookup_options.get(key, {}).get('merge') or 'first'
         try:
             meth = self.STRATEGY_METHOD[strategy]
@@ -148,23 +382,188 @@ class HieraData:
                 )
             )
 
-        return meth(self, key, default=default)
+        stats = self.hiera.stats
+        if stats is None:
+            value = meth(self, key, default=default)
+        else:
+            with stats.timer('lookup', strategy):
+                value = meth(self, key, default=default)
+        if value is not default:
+            value = copy_value(value)
+        return self.explain(key, strategy, value) if explain else value
+
+    def explain(self, key, strategy, value):
+        """ strategy で得た key の値 value について、寄与したレイヤを merge する順に並べた dict を得る
+
+        lookup() が使った索引の項目をそのまま使うので、レイヤを探し直すことはない。
+        """
+        if strategy == 'first':
+            entry = self.first_entry(key)
+            entries = [] if entry is None else [entry]
+        else:
+            entries = self.entries(key)
+        if strategy in ('hash', 'deep'):
+            entries = entries[::-1]
+        return {
+            'key': key,
+            'strategy': strategy,
+            'found': bool(entries),
+            'value': value,
+            'steps': [
+                {
+                    'hierarchy': self.loaded[num].backend.name,
+                    'path': str(self.loaded[num].path),
+                    'layer': num,
+                    'value': copy_value(self.loaded[num].resolve(val)),
+                }
+                for num, val in entries
+            ],
+        }
+
+    async def aload(self):
+        """ すべてのレイヤをイベントループの外で読み込む; 同時に呼ばれたときは一つの読み込みを共有する
+        """
+        import asyncio
+        try:
+            future = self._aloading
+        except AttributeError:
+            loop = asyncio.get_event_loop()
+            future = self._aloading = loop.run_in_executor(None, lambda: self.values)
+        await asyncio.shield(future)
+
+    async def alookup(self, key, default=None, strategy=None):
+        """ lookup() のコルーチン版; まだ読み込んでいないレイヤはイベントループの外で読み込む
+        """
+        await self.aload()
+        return self.lookup(key, default=default, strategy=strategy)
+
+    def select(self, keys, strategy=None):
+        """ keys の各 key を lookup した結果を dict で得る; 値の見つからない key があれば HieraError
+        """
+        ret = {}
+        for key in keys:
+            value = self.lookup(key, default=self.DOESNOTEXIST, strategy=strategy)
+            if value is self.DOESNOTEXIST:
+                raise HieraError(
+                    "no value found for key: '{0}'"
+                    "; config={hiera.config_file}".format(
+                        key,
+                        hiera=self.hiera,
+                    )
+                )
+            ret[key] = value
+        return ret
 
     @property
     def values(self):
+        """ すべてのレイヤ; まだ読み込んでいないレイヤもここで読み込む
+        """
+        while self.pull():
+            pass
+        return self.loaded
+
+    @property
+    def sorted_keys(self):
+        """ すべてのレイヤの文字列の key を並べた列 (keys_with_prefix() の索引)
+        """
         try:
-            return self._values
+            return self._sorted_keys
         except AttributeError:
             pass
-        ret = self._values = list(itertools.chain(*[backend.data for backend in self.backend_list]))
+        ret = self._sorted_keys = sorted(key for key in self.index if isinstance(key, str))
         return ret
 
-    def flatten(self):
-        values_list = [set(el) for el in self.values]
-        if values_list:
-            keys = set.union(*values_list) - {'lookup_options'}
-            return {
-                key: self.lookup(key)
-                for key in keys
-            }
-        return {}
+    def keys_with_prefix(self, prefix):
+        """ prefix で始まる key を key の順に得る
+        """
+        keys = self.sorted_keys
+        ret = []
+        for key in itertools.islice(keys, bisect.bisect_left(keys, prefix), None):
+            if not key.startswith(prefix):
+                break
+            ret.append(key)
+        return ret
+
+    def flatten_keys(self, sort=False, prefix=None):
+        """ flatten() の結果の key の列; sort=True なら key の順に、そうでなければ key が現れた .hierarchy の順
+
+        prefix を指定すれば prefix で始まる key だけを (key の順に) 得る。
+        """
+        if prefix is not None:
+            return [key for key in self.keys_with_prefix(prefix) if key != 'lookup_options']
+        keys = [key for key in self.index if key != 'lookup_options']
+        if sort:
+            keys.sort(key=str)
+        return keys
+
+    def iter_flatten(self, sort=False, prefix=None):
+        """ flatten() の結果を key ごとに (key, 値) で得るイテレータ; 値は取り出すときに lookup する
+        """
+        for key in self.flatten_keys(sort=sort, prefix=prefix):
+            yield key, self.lookup(key)
+
+    def explain_all(self, sort=False):
+        """ flatten() の各 key について lookup(key, explain=True) の結果を (key, 結果) で得るイテレータ
+        """
+        for key in self.flatten_keys(sort=sort):
+            yield key, self.lookup(key, explain=True)
+
+    def flatten(self, prefix=None):
+        """ すべての key を lookup した dict を得る; prefix を指定すれば prefix で始まる key だけを lookup する
+        """
+        result_cache = self.hiera.result_cache
+        if prefix is None and result_cache is not None:
+            return result_cache.flatten(self)
+        return dict(self.iter_flatten(prefix=prefix))
+
+    def refresh(self):
+        """ ディスク上で変わったデータファイルのレイヤだけを読み直す
+
+        変わったレイヤ (glob で増えたり消えたりしたものを含む) が持つ、あるいは持っていた key だけを lookup し直し、
+        値の変わった key を {key: (旧値, 新値)} で返す。値がない側は DOESNOTEXIST になる。
+        """
+        old_layers = self.values
+        reusable = {(id(item.backend), str(item.path)): item for item in old_layers}
+        layers = []
+        changed = []
+        for backend in self.backend_list:
+            for num, realpath in backend.targets():
+                item = reusable.pop((id(backend), str(realpath)), None)
+                if item is not None and item.stamp == backend.stamp(realpath):
+                    layers.append(item)
+                    continue
+                new_item = backend.reload_item(num, realpath)
+                layers.append(new_item)
+                changed.append(new_item)
+                if item is not None:
+                    changed.append(item)
+        changed.extend(reusable.values())           # 消えたレイヤ
+        if not changed:
+            return {}
+
+        keys = set(itertools.chain.from_iterable(changed))
+        if 'lookup_options' in keys:
+            # merge strategy が変わるかもしれない key も lookup し直す
+            for item in changed:
+                options = item.get('lookup_options')
+                if isinstance(options, dict):
+                    keys.update(options)
+        keys.discard('lookup_options')
+
+        old_values = {key: self.lookup(key, default=self.DOESNOTEXIST) for key in keys}
+
+        self.loaded = []
+        self.loaded_index = {}
+        self.indexed = []
+        self._layers = iter(layers)
+        self.__dict__.pop('_index', None)
+        self.__dict__.pop('_looup_options', None)
+        self.__dict__.pop('_sorted_keys', None)
+        self.values
+
+        ret = {}
+        for key, old_value in old_values.items():
+            new_value = self.lookup(key, default=self.DOESNOTEXIST)
+            if new_value != old_value:
+                ret[key] = (old_value, new_value)
+        return ret
@@ -1,4 +1,32 @@
 import logging
 
+TRACE = 5                               # DEBUG より詳細: 読み込んだデータファイルの内容まで出力する
+logging.addLevelName(TRACE, 'TRACE')
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
+
+
+def data_summary(path, data):
+    """ データファイルの大きさと key の数をまとめた dict
+    """
+    try:
+        size = path.stat().st_size
+    except OSError:
+        size = None
+    return {
+        'path': str(path),
+        'size': size,
+        'keys': len(data) if isinstance(data, dict) else 0,
+    }
+
+
+def configure(verbosity):
+    """ verbosity (0: WARNING, 1: DEBUG, 2 以上: TRACE) に応じてログを stderr に出力する
+    """
+    if verbosity <= 0:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if verbosity == 1 else TRACE)
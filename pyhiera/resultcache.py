@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import pickle
+
+from .log import logger
+from .snapshot import file_digest
+
+
+class ResultCache:
+    """ flatten() の結果をディスクに保存するキャッシュ
+
+    エントリのキーは設定ファイルの内容、コンテキスト、解決後のデータファイルのパスの列から作る。
+    エントリは各データファイルの (パス, mtime, size, sha1) を持ち、
+    size が同じで mtime か sha1 が一致するあいだだけ有効。有効なら YAML の解析も merge もしない。
+    """
+    SUFFIX = '.pickle'
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<{0.__module__}.{0.__name__} directory="{self.directory}" hits={self.hits} misses={self.misses}>'.format(
+            self.__class__,
+            self=self,
+        )
+
+    @staticmethod
+    def sources(data):
+        return [
+            str(path)
+            for backend in data.backend_list
+            for path in backend.sources()
+        ]
+
+    def fingerprint(self, data, sources):
+        digest = hashlib.sha1()
+        digest.update(file_digest(data.hiera.config_file).encode('utf-8'))
+        digest.update(json.dumps(data.context, sort_keys=True, default=str).encode('utf-8'))
+        for path in sources:
+            digest.update(b'\0' + path.encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, file_digest(path))
+
+    @staticmethod
+    def is_fresh(path, stamp):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return stamp is None
+        if stamp is None:
+            return False
+        mtime, size, digest = stamp
+        if st.st_size != size:
+            return False
+        return st.st_mtime_ns == mtime or file_digest(path) == digest
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def load(self, key):
+        try:
+            with open(self.path_for(key), 'rb') as fp:
+                stamps, result = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError) as err:
+            if not isinstance(err, FileNotFoundError):
+                logger.warning('ignoring result cache entry {}: {}'.format(key, err))
+            return None
+        if all(self.is_fresh(path, stamp) for path, stamp in stamps):
+            return result
+        return None
+
+    def store(self, key, stamps, result):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(key)
+        tmppath = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmppath, 'wb') as fp:
+            pickle.dump((stamps, result), fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmppath, path)
+
+    def flatten(self, data):
+        """ data.flatten() の結果をキャッシュから得る; なければ flatten() してキャッシュに保存する
+        """
+        sources = self.sources(data)
+        key = self.fingerprint(data, sources)
+        result = self.load(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        # スタンプは読み込みの前に得る (読み込み中に変わったファイルは次に読み直す)
+        stamps = [(path, self.stamp(path)) for path in sources]
+        result = dict(data.iter_flatten())
+        try:
+            self.store(key, stamps, result)
+        except OSError as err:
+            logger.warning('cannot write result cache {}: {}'.format(self.directory, err))
+        return result
+
+
+def default_directory():
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'pyhiera',
+    )
@@ -0,0 +1,164 @@
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+from .cache import YamlCache, file_stamp
+from .client import HieraServerError, default_socket_path, request  # noqa: F401
+from .dirindex import DirectoryIndex
+from .hiera import Hiera
+from .log import logger
+
+
+class HieraServerEntry:
+    """ (設定ファイル, コンテキスト) ごとの HieraData と、それが依存するファイルのスタンプ
+
+    glob のレベルが新しいファイルやディレクトリにマッチしたことはスタンプでは分からないので、
+    展開したデータファイルの列も保持して、確認のたびに展開し直して比べる。
+    """
+    def __init__(self, data, sources):
+        self.data = data
+        self.stamps = {path: file_stamp(path) for path in sources}
+        self.targets = self.expand(data)
+        self.checked = time.monotonic()
+
+    @staticmethod
+    def expand(data):
+        return [str(path) for backend in data.backend_list for num, path in backend.targets()]
+
+    @property
+    def flattened(self):
+        try:
+            return self._flattened
+        except AttributeError:
+            pass
+        ret = self._flattened = self.data.flatten()
+        return ret
+
+    def is_fresh(self, poll_interval):
+        now = time.monotonic()
+        if now - self.checked < poll_interval:
+            return True
+        fresh = (
+            all(file_stamp(path) == stamp for path, stamp in self.stamps.items())
+            and self.expand(self.data) == self.targets
+        )
+        if fresh:
+            self.checked = now
+        return fresh
+
+
+class HieraServerState:
+    """ サーバが保持する解析済みの設定と flatten() の結果
+    """
+    def __init__(self, poll_interval=1.0, cache=None, workers=None):
+        self.poll_interval = poll_interval
+        self.cache = cache or YamlCache()
+        self.dir_index = DirectoryIndex()
+        self.workers = workers
+        self.plans = {}
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get_plan(self, config_file):
+        stamp = file_stamp(config_file)
+        plan = self.plans.get(config_file)
+        if plan is None or plan[0] != stamp:
+            hiera = Hiera(config_file, cache=self.cache, workers=self.workers, dir_index=self.dir_index)
+            plan = self.plans[config_file] = (stamp, hiera.compile())
+        return plan[1]
+
+    @staticmethod
+    def sources(data):
+        """ data の結果が依存するファイル: 設定ファイル、各レイヤのファイルとそのディレクトリ
+        """
+        ret = {str(data.hiera.config_file)}
+        for backend in data.backend_list:
+            ret.add(str(data.hiera.base_dir.joinpath(backend.datadir)))
+            for path in backend.sources():
+                ret.add(str(path))
+                ret.add(str(path.parent))
+        return ret
+
+    def get_entry(self, config_file, context):
+        config_file = os.path.abspath(config_file)
+        key = (config_file, json.dumps(context, sort_keys=True))
+        entry = self.entries.get(key)
+        if entry is not None and entry.is_fresh(self.poll_interval):
+            return entry
+
+        plan = self.get_plan(config_file)
+        plan.reset()
+        data = plan.evaluate(context)
+        entry = self.entries[key] = HieraServerEntry(data, self.sources(data))
+        logger.debug('loaded config=%s context=%s', config_file, context)
+        return entry
+
+    def lookup(self, config_file, context, keys=None, strategy=None):
+        with self.lock:
+            entry = self.get_entry(config_file, context)
+            if keys:
+                return entry.data.select(keys, strategy=strategy)
+            return entry.flattened
+
+    def handle_request(self, payload):
+        try:
+            config_file = payload['config']
+        except KeyError:
+            raise HieraServerError("request expects a value for key 'config'")
+        return self.lookup(
+            config_file,
+            payload.get('context') or {},
+            keys=payload.get('keys'),
+            strategy=payload.get('strategy'),
+        )
+
+
+class HieraRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                result = {'data': self.server.state.handle_request(json.loads(line.decode('utf-8')))}
+            except Exception as err:
+                result = {'error': "{}: {}".format(type(err).__name__, err)}
+            self.wfile.write(json.dumps(result).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class HieraServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ 解析済みの hiera データをメモリに保持して Unix ソケットで lookup に応える
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, state=None):
+        self.state = state or HieraServerState()
+        self.remove_stale_socket(socket_path)
+        super().__init__(socket_path, HieraRequestHandler)
+
+    @staticmethod
+    def remove_stale_socket(socket_path):
+        """ socket_path に残っている、待ち受けるサーバのいないソケットを消す; ソケット以外やサーバが動いていれば HieraServerError
+        """
+        try:
+            st = os.stat(socket_path)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(st.st_mode):
+            raise HieraServerError("not a socket: {}".format(socket_path))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)
+                return
+        raise HieraServerError("another server is listening on {}".format(socket_path))
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
@@ -6,22 +6,39 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
 
-def load_settings_from_config(hiera_configs, namespace=None, **context):
+def load_settings_from_config(hiera_configs, namespace=None, result_cache=None, **context):
+    """ hiera_configs のうち最初に見つかった設定ファイルを flatten() した dict を返す
+
+    namespace を指定すれば NAMESPACE_ で始まる key (接頭辞は取り除く) と ENVIRONMENT, CONFIG だけを返す。
+    result_cache (ディレクトリ、または True でデフォルトのディレクトリ) を指定すれば flatten() の結果をディスクにキャッシュする。
+    """
     for confpath in hiera_configs if isinstance(hiera_configs, (list, tuple)) else (hiera_configs,):
         if not os.path.exists(confpath):
             continue
         logger.info("### config: {}".format(confpath))
-        hiera = Hiera.load_data(confpath, context=context)
-        hiera_data = hiera.flatten()
+        hiera = Hiera.load_data(confpath, context=context, result_cache=result_cache)
+        if namespace and result_cache:
+            # キャッシュした全体の結果から絞り込む
+            prefix = '{}_'.format(namespace.upper())
+            return {
+                key.replace(prefix, ''): val
+                for key, val in hiera.flatten().items()
+                if key.startswith(prefix) or key in ('ENVIRONMENT', 'CONFIG')
+            }
+
         if namespace:
+            # namespace の key と ENVIRONMENT/CONFIG だけを lookup する
             prefix = '{}_'.format(namespace.upper())
+            hiera_data = hiera.flatten(prefix=prefix)
+            for key in ('ENVIRONMENT', 'CONFIG'):
+                if key in hiera.index and key not in hiera_data:
+                    hiera_data[key] = hiera.lookup(key)
             return {
                 key.replace(prefix, ''): val
                 for key, val in hiera_data.items()
-                if key.startswith(prefix) or key in ('ENVIRONMENT', 'CONFIG')
             }
 
-        return hiera_data
+        return hiera.flatten()
 
     logger.warning("# WARNING -- no config file found.")
     return {}
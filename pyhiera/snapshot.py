@@ -0,0 +1,138 @@
+import hashlib
+import mmap
+import os
+import pathlib
+import pickle
+import struct
+
+from .exceptions import HieraError
+from .log import logger
+from .yaml import load_yaml
+
+
+class HieraSnapshotError(HieraError):
+    pass
+
+
+def file_digest(path):
+    """ path の内容の sha1; 大きなファイル (sqlite_data のデータベースなど) も一定の大きさずつ読む
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HieraSnapshot:
+    """ 解析済みのデータファイルをまとめたスナップショット (`pyhiera compile` で作る)
+
+    ファイルの構成: MAGIC, 索引の長さ (8 バイト), pickle した索引, pickle した各データファイルの内容。
+    索引は実パスごとに (mtime_ns, size, sha1, オフセット, 長さ) を持つ。
+    ファイルは mmap して、参照されたデータファイルの内容だけを unpickle する。
+    """
+    MAGIC = b'PYHIERA-SNAPSHOT-1\n'
+    HEADER = struct.Struct('>Q')
+    SUFFIX = '.snapshot'
+    PATTERNS = ('**/*.yaml', '**/*.yml')
+    MISSING = object()
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        with self.path.open('rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(self.MAGIC)
+        if self.mm[:start] != self.MAGIC:
+            self.mm.close()
+            raise HieraSnapshotError("not a pyhiera snapshot: {}".format(self.path))
+        size, = self.HEADER.unpack_from(self.mm, start)
+        start += self.HEADER.size
+        self.index = pickle.loads(self.mm[start:start + size])
+        self.base = start + size
+
+    def __repr__(self):
+        return '<{0.__module__}.{0.__name__} path="{self.path}" files={1}>'.format(
+            self.__class__,
+            len(self.index),
+            self=self,
+        )
+
+    @classmethod
+    def path_for(cls, config_file):
+        config_file = pathlib.Path(config_file)
+        return config_file.with_name(config_file.name + cls.SUFFIX)
+
+    @classmethod
+    def open(cls, config_file):
+        """ config_file のスナップショットを開く; なければ、あるいは読めなければ None
+        """
+        path = cls.path_for(config_file)
+        if not path.exists():
+            return None
+        try:
+            return cls(path)
+        except (HieraSnapshotError, OSError, pickle.UnpicklingError, struct.error) as err:
+            logger.warning('ignoring snapshot {}: {}'.format(path, err))
+            return None
+
+    def close(self):
+        self.mm.close()
+
+    def load(self, path):
+        """ path の解析結果を返す; スナップショットになければ、あるいはファイルが変わっていれば MISSING
+        """
+        key = os.path.realpath(path)
+        try:
+            mtime, size, digest, offset, length = self.index[key]
+        except KeyError:
+            return self.MISSING
+        try:
+            st = os.stat(key)
+        except OSError:
+            return self.MISSING
+        if st.st_size != size:
+            return self.MISSING
+        if st.st_mtime_ns != mtime and file_digest(key) != digest:
+            return self.MISSING
+        start = self.base + offset
+        return pickle.loads(self.mm[start:start + length])
+
+    @classmethod
+    def sources(cls, plan):
+        """ plan の各 .hierarchy の datadir にある YAML ファイルを得る
+        """
+        ret = set()
+        base_dir = plan.hiera.base_dir
+        for datadir in {opts['datadir'] for klass, opts in plan.hierarchy}:
+            for pattern in cls.PATTERNS:
+                ret.update(path for path in base_dir.joinpath(datadir).glob(pattern) if path.is_file())
+        return sorted(ret)
+
+    @classmethod
+    def write(cls, plan, path=None):
+        """ plan の datadir にあるデータファイルを解析してスナップショットを書き出し、そのパスを返す
+        """
+        path = pathlib.Path(path or cls.path_for(plan.hiera.config_file))
+        index = {}
+        blobs = []
+        offset = 0
+        for source in cls.sources(plan):
+            key = os.path.realpath(source)
+            with open(key, 'rb') as fp:
+                content = fp.read()
+                st = os.fstat(fp.fileno())
+            blob = pickle.dumps(load_yaml(content), protocol=pickle.HIGHEST_PROTOCOL)
+            index[key] = (st.st_mtime_ns, st.st_size, hashlib.sha1(content).hexdigest(), offset, len(blob))
+            blobs.append(blob)
+            offset += len(blob)
+
+        header = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+        tmppath = path.with_name(path.name + '.tmp')
+        with tmppath.open('wb') as fp:
+            fp.write(cls.MAGIC)
+            fp.write(cls.HEADER.pack(len(header)))
+            fp.write(header)
+            for blob in blobs:
+                fp.write(blob)
+        tmppath.replace(path)
+        return path
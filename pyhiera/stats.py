@@ -0,0 +1,67 @@
+import collections
+import contextlib
+import threading
+import time
+
+
+class HieraStats:
+    """ 読み込みと lookup の時間と回数の集計
+
+    Hiera(stats=...) に渡したときだけ集計する。渡さなければ各計測点は stats が None かを見るだけになる。
+    区分 (section) ごとに名前をつけて (回数, 合計時間) を集める:
+
+      targets   .hierarchy のレベルごとのパスの解決と glob 展開
+      level     .hierarchy のレベルごとのレイヤの読み込み (並行読み込みでは待ち時間)
+      file      データファイルごとの読み込み (スナップショット、キャッシュ、YAML の解析を含む)
+      io/parse  キャッシュを通さずに YAML を読むときのファイルの読み込みと解析
+      lookup    merge strategy ごとの lookup (補間を含む)
+      interpolate  lookup した値の補間 (合計)
+    """
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{0.__module__}.{0.__name__} entries={1}>'.format(
+            self.__class__,
+            len(self.entries),
+        )
+
+    def add(self, section, name, elapsed=0.0, count=1):
+        key = (section, name)
+        with self.lock:
+            total_count, total_elapsed = self.entries.get(key, (0, 0.0))
+            self.entries[key] = (total_count + count, total_elapsed + elapsed)
+
+    @contextlib.contextmanager
+    def timer(self, section, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(section, name, time.perf_counter() - start)
+
+    def timed_iter(self, section, name, iterable):
+        """ iterable から要素を取り出すのにかかった時間を集計するイテレータ
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(section, name, time.perf_counter() - start)
+            yield item
+
+    def as_dict(self):
+        ret = {}
+        for (section, name), (count, elapsed) in self.entries.items():
+            ret.setdefault(section, {})[name] = {'count': count, 'seconds': elapsed}
+        return ret
+
+    def report(self):
+        lines = ['{:<12} {:<48} {:>8} {:>10}'.format('section', 'name', 'count', 'seconds')]
+        for (section, name), (count, elapsed) in sorted(self.entries.items(), key=lambda el: el[0][0]):
+            lines.append('{:<12} {:<48} {:>8} {:>10.4f}'.format(section, str(name), count, elapsed))
+        return '\n'.join(lines) + '\n'
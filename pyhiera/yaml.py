@@ -18,3 +18,13 @@ def load_yaml(*args, Loader=SafeLoader, **kwargs):
 
 def dump_yaml(*args, Dumper=SafeDumper, **kwargs):
     return yaml.dump(*args, Dumper=Dumper, **kwargs)
+
+
+def load_yaml_file(path):
+    """ path の YAML を解析する; 読めなければ None (プロセスプールからも呼べるようモジュール関数にしている)
+    """
+    try:
+        with open(path, 'r') as fp:
+            return load_yaml(fp)
+    except IOError:
+        return None
@@ -14,7 +14,7 @@ setup(
     author="Tatsuo Nakajyo",
     author_email="tnak@nekonaq.com",
     license='BSD',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     python_requires='>=3.6.9',
     install_requires=['pyyaml'],
     entry_points={